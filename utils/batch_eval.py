@@ -0,0 +1,142 @@
+"""
+batch_eval.py
+
+Script to score system predictions for many corpora at once, using the official scorers seg_eval.py and rel_eval.py.
+
+The predictions directory must mirror the layout of data/, e.g. a prediction for data/eng.rst.gum/eng.rst.gum_dev.tok
+is expected at <pred_dir>/eng.rst.gum/eng.rst.gum_dev.tok. Gold files without a corresponding prediction are skipped.
+Files are scored in parallel worker processes and all results are written to one consolidated table.
+
+Arguments:
+ * pred_dir: directory with system predictions, mirroring data/
+ * -g/--gold_dir: directory with gold corpora (default: ../data)
+ * -o/--outfile: output table; .json for JSON, anything else for TSV (default: print TSV to stdout)
+ * -j/--jobs: number of worker processes (default: number of cores)
+
+"""
+
+__license__ = "Apache 2.0"
+__version__ = "1.0.0"
+
+import io, os, sys, json
+from argparse import ArgumentParser
+from concurrent.futures import ProcessPoolExecutor
+from glob import glob
+
+from seg_eval import get_scores
+from rel_eval import get_accuracy_score
+from eval_errors import EvaluationError
+
+PARTITIONS = ("dev", "test")
+EXTENSIONS = ("tok", "conllu", "rels")
+COLUMNS = ["corpus", "file", "task", "tok_count", "gold_count", "pred_count", "prec", "rec", "f_score", "acc", "error"]
+
+
+def find_pairs(gold_dir, pred_dir, partitions=PARTITIONS, extensions=EXTENSIONS):
+	"""
+	Find every gold file with a matching prediction file
+
+	:param gold_dir: directory containing one folder per corpus, e.g. ../data
+	:param pred_dir: directory mirroring gold_dir with system predictions
+	:param partitions: which partitions to score
+	:param extensions: which file types to score
+	:return: sorted list of (corpus, gold_path, pred_path) tuples
+	"""
+	pairs = []
+	for corpus_dir in sorted(glob(gold_dir + os.sep + "*" + os.sep)):
+		corpus = os.path.basename(os.path.normpath(corpus_dir))
+		for partition in partitions:
+			for ext in extensions:
+				gold_path = os.path.join(gold_dir, corpus, corpus + "_" + partition + "." + ext)
+				pred_path = os.path.join(pred_dir, corpus, corpus + "_" + partition + "." + ext)
+				if os.path.isfile(gold_path) and os.path.isfile(pred_path):
+					pairs.append((corpus, gold_path, pred_path))
+	return pairs
+
+
+def score_pair(pair):
+	"""
+	Score a single gold/pred pair in-process
+
+	:param pair: tuple of (corpus, gold_path, pred_path)
+	:return: dictionary with one row of the results table
+	"""
+	corpus, gold_path, pred_path = pair
+	row = {col: None for col in COLUMNS}
+	row["corpus"] = corpus
+	row["file"] = os.path.basename(gold_path)
+	try:
+		if gold_path.endswith(".rels"):
+			row["task"] = "rel"
+			score_dict = get_accuracy_score(gold_path, pred_path)
+			row["gold_count"] = score_dict["gold_rel_count"]
+			row["pred_count"] = score_dict["pred_rel_count"]
+			row["acc"] = score_dict["acc_score"]
+		else:
+			row["task"] = "seg"
+			score_dict = get_scores(gold_path, pred_path)
+			row["tok_count"] = score_dict["tok_count"]
+			row["gold_count"] = score_dict["gold_seg_count"]
+			row["pred_count"] = score_dict["pred_seg_count"]
+			row["prec"] = score_dict["prec"]
+			row["rec"] = score_dict["rec"]
+			row["f_score"] = score_dict["f_score"]
+	except EvaluationError as e:
+		row["error"] = e.summary()
+	except (IOError, ValueError) as e:  # Unreadable predictions, e.g. not valid UTF-8
+		row["error"] = repr(e)
+	return row
+
+
+def run_batch(pairs, jobs=None):
+	"""
+	Score all pairs in parallel worker processes
+
+	:param pairs: list of (corpus, gold_path, pred_path) tuples, as returned by find_pairs
+	:param jobs: number of worker processes, or None to use all cores
+	:return: list of result rows in the same order as pairs
+	"""
+	if jobs == 1 or len(pairs) < 2:
+		return [score_pair(pair) for pair in pairs]
+	with ProcessPoolExecutor(max_workers=jobs) as executor:
+		return list(executor.map(score_pair, pairs))
+
+
+def write_results(rows, outfile=None, columns=COLUMNS):
+	"""
+	Write results as JSON if outfile ends in .json, otherwise as TSV
+
+	:param rows: list of result rows
+	:param outfile: output file name, or None to print TSV to stdout
+	:param columns: TSV columns, in order; missing values are written as _
+	"""
+	if outfile is not None and outfile.endswith(".json"):
+		with io.open(outfile, "w", encoding="utf8", newline="\n") as f:
+			f.write(json.dumps(rows, indent=2) + "\n")
+		return
+
+	lines = ["\t".join(columns)]
+	for row in rows:
+		lines.append("\t".join("_" if row[col] is None else str(row[col]) for col in columns))
+	output = "\n".join(lines) + "\n"
+	if outfile is None:
+		sys.stdout.write(output)
+	else:
+		with io.open(outfile, "w", encoding="utf8", newline="\n") as f:
+			f.write(output)
+
+
+if __name__ == "__main__":
+	p = ArgumentParser()
+	p.add_argument("pred_dir", help="Directory with system predictions, mirroring the data/ directory")
+	p.add_argument("-g", "--gold_dir", default=os.sep.join(["..", "data"]), help="Directory with gold corpora")
+	p.add_argument("-o", "--outfile", default=None, help="Output file (.json or .tsv); prints TSV if not given")
+	p.add_argument("-j", "--jobs", type=int, default=None, help="Number of worker processes (default: all cores)")
+
+	opts = p.parse_args()
+
+	pairs = find_pairs(opts.gold_dir, opts.pred_dir)
+	sys.stderr.write("o Found " + str(len(pairs)) + " gold/pred file pairs\n")
+	rows = run_batch(pairs, opts.jobs)
+	write_results(rows, opts.outfile)
+	sys.stderr.write("o Scored " + str(len(rows)) + " files, " + str(len([r for r in rows if r["error"]])) + " errors\n")
@@ -0,0 +1,100 @@
+"""
+bench_lines.py
+
+Microbenchmark for the shared line helpers in conll_lines.py. For each helper, the per-line cost of the inline code
+it replaced ("before") and of the helper ("after") is measured over the lines of the dev files in data/.
+
+Arguments:
+ * -d/--data_dir: data directory (default: ../data)
+ * -r/--repeat: number of timing repetitions, of which the fastest is reported (default: 3)
+
+"""
+
+__license__ = "Apache 2.0"
+__version__ = "1.0.0"
+
+import io, os, re, sys, time
+from argparse import ArgumentParser
+from glob import glob
+
+from conll_lines import KEPT_COMMENT_RE, normalize_label, last_field, underscore, underscore_rel, remove_whitespace
+
+
+def old_normalize(line):
+	fields = line.split("\t")
+	label = fields[-1]
+	if "BeginSeg=Yes" in label:
+		label = "BeginSeg=Yes"
+	elif "Seg=B-Conn" in label:
+		label = "Seg=B-Conn"
+	elif "Seg=I-Conn" in label:
+		label = "Seg=I-Conn"
+	else:
+		label = "_"
+	return fields[1], label
+
+
+def new_normalize(line):
+	fields = line.split("\t")
+	return fields[1], normalize_label(fields[-1])
+
+
+def old_underscore_rel(text):
+	blanked = []
+	text = text.replace("<*>","❤")
+	for c in text:
+		if c!="❤" and c!=" ":
+			blanked.append("_")
+		else:
+			blanked.append(c)
+	return "".join(blanked).replace("❤","<*>")
+
+
+def time_per_line(func, items, repeat):
+	best = None
+	for _ in range(repeat):
+		start = time.perf_counter()
+		for item in items:
+			func(item)
+		elapsed = time.perf_counter() - start
+		best = elapsed if best is None else min(best, elapsed)
+	return best / max(len(items), 1) * 1e9
+
+
+def read_lines(pattern):
+	lines = []
+	for file_ in sorted(glob(pattern)):
+		with io.open(file_, encoding="utf8") as f:
+			lines += f.read().split("\n")
+	return lines
+
+
+if __name__ == "__main__":
+	p = ArgumentParser()
+	p.add_argument("-d", "--data_dir", default=os.sep.join(["..", "data"]), help="Data directory")
+	p.add_argument("-r", "--repeat", type=int, default=3, help="Timing repetitions (fastest is reported)")
+	opts = p.parse_args()
+
+	conllu = read_lines(os.sep.join([opts.data_dir, "*", "*_dev.conllu"]))
+	comments = [line for line in conllu if line.startswith("#")]
+	texts = [line.split("=", 1)[1] for line in comments if line.startswith("# text")]
+	tokens = [line for line in read_lines(os.sep.join([opts.data_dir, "*", "*_dev.tok"])) if "\t" in line]
+	rels = [line for line in read_lines(os.sep.join([opts.data_dir, "*", "*_dev.rels"])) if "\t" in line]
+	rel_texts = [line.split("\t")[7] for line in rels]
+
+	benchmarks = [
+		("comment regex", comments,
+		 lambda line: re.match(r'# ?(newdoc id|sent_id|text) ?= ?(.+)', line), KEPT_COMMENT_RE.match),
+		("token label", tokens, old_normalize, new_normalize),
+		("rels label", rels, lambda line: line.split("\t")[-1], last_field),
+		("underscore text", texts, lambda text: re.sub(r'[^\s]', '_', text), underscore),
+		("underscore rels", rel_texts, old_underscore_rel, underscore_rel),
+		("remove whitespace", conllu, lambda text: re.sub(r'\s', '', text), remove_whitespace),
+	]
+
+	print("\t".join(["helper", "lines", "before_ns_per_line", "after_ns_per_line", "speedup"]))
+	for name, items, before, after in benchmarks:
+		before_ns = time_per_line(before, items, opts.repeat)
+		after_ns = time_per_line(after, items, opts.repeat)
+		print("\t".join([name, str(len(items)), "%.1f" % before_ns, "%.1f" % after_ns, "%.2fx" % (before_ns / after_ns)]))
+		sys.stdout.flush()
@@ -0,0 +1,339 @@
+"""
+bench_suite.py
+
+Benchmark suite for the hot paths of the scripts in utils/, run over the dev and test files of each corpus in data/.
+Each benchmark is run for one corpus at a time in a fresh worker process, which reports the fastest wall time of
+several repetitions, the throughput in tokens (or relation instances) per second and the peak resident memory of the
+worker process.
+
+Benchmarks:
+ * parse_data: seg_eval.parse_data on .tok and .conllu files
+ * get_scores: seg_eval.get_scores of each .tok and .conllu file against itself
+ * rel_eval: rel_eval.get_accuracy_score of each .rels file against itself
+ * clean: process_files.clean_file on .conllu files, including the plain .tok output
+ * restore: process_underscores.restore_docs on underscored copies of the .conllu, .tok and .rels files, using a
+   synthetic stand-in for the LDC source text which is derived from the token strings of the corpus; as in the
+   process_underscores.py CLI, GUM documents other than Reddit have no source text
+
+Results can be saved as a JSON baseline and later runs compared against it, flagging benchmarks whose wall time or
+peak memory grew by more than a threshold (exit code 1 if any regression is found):
+
+```
+python bench_suite.py -s baseline.json
+python bench_suite.py -b baseline.json -t 0.1
+```
+
+Arguments:
+ * -d/--data_dir: data directory (default: ../data)
+ * -c/--corpus: only run corpora whose names contain this string (can be repeated)
+ * -k/--bench: only run these benchmarks (can be repeated, default: all)
+ * -r/--repeat: number of timing repetitions, of which the fastest is reported (default: 3)
+ * -s/--save: write the results to this JSON file
+ * -b/--baseline: JSON file with results of an earlier run to compare against
+ * -t/--threshold: relative increase in wall time or peak memory counted as a regression (default: 0.1)
+
+"""
+
+__license__ = "Apache 2.0"
+__version__ = "1.0.0"
+
+import io, os, sys, json, time, shutil, platform, tempfile, contextlib, multiprocessing
+from argparse import ArgumentParser
+from glob import glob
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor
+
+from conll_lines import TOKEN, NEWDOC_RE, classify, read_lines
+from rels_table import iter_lines
+
+COLUMNS = ["bench", "corpus", "items", "unit", "wall_s", "items_per_s", "peak_rss_mb", "status"]
+
+
+def split_files(data_dir, corpus, extensions):
+	"""
+	:param data_dir: data directory
+	:param corpus: corpus directory name, e.g. eng.rst.gum
+	:param extensions: file extensions to include, e.g. ("tok", "conllu")
+	:return: sorted list of absolute paths of the dev and test files of the corpus with these extensions
+	"""
+	files = []
+	for ext in extensions:
+		for partition in ["dev", "test"]:
+			files += glob(os.path.join(data_dir, corpus, "*_" + partition + "." + ext))
+	return sorted(os.path.abspath(file_) for file_ in files)
+
+
+def count_tokens(files):
+	"""
+	:param files: .tok or .conllu files
+	:return: number of token lines, not counting multiword token ranges and empty nodes
+	"""
+	count = 0
+	for file_ in files:
+		for line in read_lines(file_):
+			if classify(line) == TOKEN:
+				tok_id = line.split("\t", 1)[0]
+				if "-" not in tok_id and "." not in tok_id:
+					count += 1
+	return count
+
+
+def count_instances(files):
+	"""
+	:param files: .rels files
+	:return: number of relation instances, not counting header rows
+	"""
+	count = 0
+	for file_ in files:
+		for l, line in enumerate(iter_lines(file_)):
+			if l > 0 or not line.startswith("doc\t"):
+				count += 1
+	return count
+
+
+def synthetic_ldc_text(conllu_files):
+	"""
+	Make a stand-in for the harvested LDC source text of the documents in some .conllu files, with the same number of
+	non-whitespace characters per document as their tokens. For corpora which are distributed with text, the stand-in
+	is the text itself; for underscored corpora it consists of underscores.
+
+	:param conllu_files: .conllu files
+	:return: dictionary of document names to strings of non-whitespace characters, as produced by harvest_text; for
+	         GUM, a defaultdict with only the Reddit documents, as produced by get_no_space_strings
+	"""
+	docs = {}
+	chunks = []
+	docname = None
+	for file_ in conllu_files:
+		skiplen = 0
+		for line in read_lines(file_):
+			m = NEWDOC_RE.search(line) if "# newdoc id " in line else None  # Malformed newdoc lines are comments
+			if m is not None:
+				if docname is not None:
+					docs[docname] = "".join(chunks)
+				docname = m.group(1)
+				chunks = []
+			elif classify(line) == TOKEN:
+				fields = line.split("\t")
+				if skiplen < 1:
+					chunks.append("".join("_" if c.isspace() else c for c in fields[1]))
+				else:
+					skiplen -= 1
+				if "-" in fields[0]:  # Multitoken
+					start, end = fields[0].split("-")
+					skiplen = int(end) - int(start) + 1
+	if docname is not None:
+		docs[docname] = "".join(chunks)
+	if any("GUM_" in docname for docname in docs):  # Only Reddit documents need reconstruction in GUM
+		return defaultdict(str, {docname: text for docname, text in docs.items() if "reddit" in docname})
+	return docs
+
+
+def bench_parse_data(files, tmp_dir):
+	from seg_eval import parse_data
+	start = time.perf_counter()
+	for file_ in files:
+		parse_data(file_)
+	return time.perf_counter() - start
+
+
+def bench_get_scores(files, tmp_dir):
+	from seg_eval import get_scores
+	start = time.perf_counter()
+	for file_ in files:
+		get_scores(file_, file_)
+	return time.perf_counter() - start
+
+
+def bench_rel_eval(files, tmp_dir):
+	from rel_eval import get_accuracy_score
+	start = time.perf_counter()
+	for file_ in files:
+		get_accuracy_score(file_, file_)
+	return time.perf_counter() - start
+
+
+def bench_clean(files, tmp_dir):
+	from process_files import clean_file
+	start = time.perf_counter()
+	for file_ in files:
+		outfile = os.path.join(tmp_dir, os.path.basename(file_) + ".conll")
+		clean_file(file_, outfile, outfile + ".tok")
+	return time.perf_counter() - start
+
+
+def bench_restore(files, tmp_dir):
+	from process_underscores import underscore_file, restore_docs
+	corpus_dir = os.path.join(tmp_dir, "corpus")
+	if os.path.exists(corpus_dir):
+		shutil.rmtree(corpus_dir)
+	os.mkdir(corpus_dir)
+	for file_ in files:
+		copy = os.path.join(corpus_dir, os.path.basename(file_))
+		shutil.copyfile(file_, copy)
+		underscore_file(copy)
+	text_dict = synthetic_ldc_text([file_ for file_ in files if file_.endswith(".conllu")])
+
+	start = time.perf_counter()
+	restore_docs(corpus_dir, text_dict)
+	return time.perf_counter() - start
+
+
+# Benchmark name -> (function, file extensions, unit of throughput)
+BENCHMARKS = {
+	"parse_data": (bench_parse_data, ("tok", "conllu"), "tokens"),
+	"get_scores": (bench_get_scores, ("tok", "conllu"), "tokens"),
+	"rel_eval": (bench_rel_eval, ("rels",), "instances"),
+	"clean": (bench_clean, ("conllu",), "tokens"),
+	"restore": (bench_restore, ("conllu", "tok", "rels"), "tokens"),
+}
+
+
+def peak_rss_mb():
+	"""
+	:return: peak resident memory of the current process in MB, or None if it cannot be measured on this platform
+	"""
+	try:
+		import resource
+	except ImportError:
+		return None
+	peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+	if sys.platform == "darwin":  # Bytes on macOS, kilobytes elsewhere
+		return peak / 1024 / 1024
+	return peak / 1024
+
+
+def run_case(job):
+	"""
+	Run one benchmark on the files of one corpus. Progress messages of the benchmarked scripts are suppressed, and
+	scripts exiting on inconsistent data (e.g. .rels text which does not match the .conllu tokens) raise RuntimeError.
+
+	:param job: tuple of (benchmark name, corpus name, list of files, number of repetitions)
+	:return: dictionary with one row of results
+	"""
+	bench, corpus, files, repeat = job
+	func, extensions, unit = BENCHMARKS[bench]
+	if unit == "instances":
+		items = count_instances(files)
+	else:
+		items = count_tokens([file_ for file_ in files if not file_.endswith(".rels")])
+
+	best = None
+	log = io.StringIO()
+	tmp_dir = tempfile.mkdtemp()
+	cwd = os.getcwd()
+	os.chdir(tmp_dir)  # Scripts write debug files to the working directory
+	try:
+		with contextlib.redirect_stderr(log):
+			for _ in range(repeat):
+				elapsed = func(files, tmp_dir)
+				best = elapsed if best is None else min(best, elapsed)
+	except SystemExit:  # Scripts exit on inconsistent data, after writing a message starting with "!"
+		messages = [line for line in log.getvalue().split("\n") if line.startswith("!")]
+		raise RuntimeError(messages[-1] if len(messages) > 0 else "exited")
+	finally:
+		os.chdir(cwd)
+		shutil.rmtree(tmp_dir)
+
+	return {"bench": bench, "corpus": corpus, "items": items, "unit": unit, "wall_s": best,
+			"items_per_s": items / best if best > 0 else None, "peak_rss_mb": peak_rss_mb()}
+
+
+def run_isolated(job):
+	"""
+	Run one benchmark in a fresh worker process, so that its peak memory is not inflated by earlier benchmarks
+
+	:param job: see run_case
+	:return: dictionary with one row of results, with an error message in "status" if the benchmark failed
+	"""
+	with ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context("spawn")) as executor:
+		try:
+			return executor.submit(run_case, job).result()
+		except BaseException as e:
+			bench, corpus, files, repeat = job
+			return {"bench": bench, "corpus": corpus, "items": None, "unit": BENCHMARKS[bench][2], "wall_s": None,
+					"items_per_s": None, "peak_rss_mb": None, "status": "error: " + repr(e)}
+
+
+def compare(row, baseline, threshold):
+	"""
+	:param row: dictionary with one row of results
+	:param baseline: dictionary of (bench, corpus) -> row of results from an earlier run
+	:param threshold: relative increase counted as a regression, e.g. 0.1 for 10%
+	:return: status string, starting with "REGRESSION" if wall time or peak memory grew by more than the threshold
+	"""
+	if row.get("status", "").startswith("error"):
+		return row["status"]
+	base = baseline.get((row["bench"], row["corpus"]))
+	if base is None or base.get("wall_s") is None:
+		return "new"
+	changes = []
+	regressions = []
+	for key, name in [("wall_s", "time"), ("peak_rss_mb", "memory")]:
+		if row[key] is None or not base.get(key):
+			continue
+		change = row[key] / base[key] - 1
+		changes.append(name + " %+.1f%%" % (change * 100))
+		if change > threshold:
+			regressions.append(name)
+	if len(regressions) > 0:
+		return "REGRESSION (" + ", ".join(regressions) + "): " + ", ".join(changes)
+	return "ok: " + ", ".join(changes)
+
+
+def format_row(row):
+	values = []
+	for col in COLUMNS:
+		value = row.get(col)
+		if value is None:
+			values.append("_")
+		elif isinstance(value, float):
+			values.append("%.3f" % value if col == "wall_s" else "%.1f" % value)
+		else:
+			values.append(str(value))
+	return "\t".join(values)
+
+
+if __name__ == "__main__":
+	p = ArgumentParser()
+	p.add_argument("-d", "--data_dir", default=os.sep.join(["..", "data"]), help="Data directory")
+	p.add_argument("-c", "--corpus", action="append", default=None, help="Only run corpora whose names contain this string")
+	p.add_argument("-k", "--bench", action="append", choices=list(BENCHMARKS), default=None, help="Only run these benchmarks")
+	p.add_argument("-r", "--repeat", type=int, default=3, help="Timing repetitions (fastest is reported)")
+	p.add_argument("-s", "--save", default=None, help="Write results to this JSON file")
+	p.add_argument("-b", "--baseline", default=None, help="JSON file with earlier results to compare against")
+	p.add_argument("-t", "--threshold", type=float, default=0.1, help="Relative increase in time or memory counted as a regression")
+	opts = p.parse_args()
+
+	baseline = {}
+	if opts.baseline is not None:
+		with io.open(opts.baseline, encoding="utf8") as f:
+			baseline = {(row["bench"], row["corpus"]): row for row in json.load(f)["results"]}
+
+	corpora = sorted(os.path.basename(os.path.normpath(d)) for d in glob(os.path.join(opts.data_dir, "*", "")))
+	if opts.corpus is not None:
+		corpora = [corpus for corpus in corpora if any(name in corpus for name in opts.corpus)]
+
+	results = []
+	regressions = 0
+	print("\t".join(COLUMNS))
+	for bench in opts.bench or list(BENCHMARKS):
+		for corpus in corpora:
+			files = split_files(opts.data_dir, corpus, BENCHMARKS[bench][1])
+			if len(files) == 0:
+				continue
+			row = run_isolated((bench, corpus, files, opts.repeat))
+			row["status"] = compare(row, baseline, opts.threshold)
+			if row["status"].startswith("REGRESSION"):
+				regressions += 1
+			results.append(row)
+			print(format_row(row))
+			sys.stdout.flush()
+
+	if opts.save is not None:
+		with io.open(opts.save, "w", encoding="utf8", newline="\n") as f:
+			f.write(json.dumps({"python": platform.python_version(), "platform": platform.platform(),
+								"repeat": opts.repeat, "results": results}, indent=2) + "\n")
+	if regressions > 0:
+		sys.stderr.write("! " + str(regressions) + " benchmarks regressed by more than " + "%.0f%%" % (opts.threshold * 100) + "\n")
+		sys.exit(1)
@@ -0,0 +1,153 @@
+"""
+conll_lines.py
+
+Shared helpers for classifying and rewriting lines of the shared task formats (.conllu, .tok and .rels),
+used by seg_eval.py, rel_eval.py, process_files.py and process_underscores.py.
+
+Patterns are compiled once at import time, lines are classified by their first character before any substring
+scans, and blanking text with underscores uses str.translate instead of per-character regex substitution.
+
+Run bench_lines.py to compare the per-line cost of these helpers against the inline code they replace.
+
+"""
+
+__license__ = "Apache 2.0"
+__version__ = "1.0.0"
+
+import io, re
+
+# Line kinds
+TOKEN = 0
+COMMENT = 1
+BLANK = 2
+OTHER = 3
+
+DIGITS = frozenset("0123456789")
+
+# Comment lines kept by process_files.py, e.g. "# newdoc id = GUM_academic_art"
+KEPT_COMMENT_RE = re.compile(r'# ?(newdoc id|sent_id|text) ?= ?(.+)')
+NEWDOC_RE = re.compile(r'# newdoc id ?= ?([^\s]+)')
+TEXT_RE = re.compile(r'(# ?text ?= ?)(.+)')
+UNDERSCORED_TEXT_RE = re.compile(r'(# text ?= ?)(.+)')
+
+
+def classify(line):
+	"""
+	Classify a line by its first character. Lines containing a tab are token lines, as in all scripts of this
+	repository; the tab scan is skipped for the common cases of comments and blank lines.
+
+	:param line: a line from a .conllu or .tok file
+	:return: one of TOKEN, COMMENT, BLANK or OTHER
+	"""
+	first = line[:1]
+	if first in DIGITS:
+		return TOKEN if "\t" in line else OTHER
+	if first == "#":
+		return COMMENT if "\t" not in line else TOKEN
+	if line.strip() == "":
+		return BLANK
+	return TOKEN if "\t" in line else OTHER
+
+
+def last_field(line):
+	"""
+	:return: the last tab-delimited field of a line, without splitting the other fields
+	"""
+	return line.rpartition("\t")[2]
+
+
+SEG_LABELS = {"_": "_", "BeginSeg=Yes": "BeginSeg=Yes", "Seg=B-Conn": "Seg=B-Conn", "Seg=I-Conn": "Seg=I-Conn"}
+
+
+def normalize_label(label):
+	"""
+	Reduce a column 10 value to one of the four labels used in segmentation scoring
+
+	:param label: contents of the last token column, possibly with other pipe-delimited annotations
+	:return: one of "BeginSeg=Yes", "Seg=B-Conn", "Seg=I-Conn" or "_"
+	"""
+	# Fast path for plain labels, which is almost every token
+	plain = SEG_LABELS.get(label)
+	if plain is not None:
+		return plain
+	# Ensure correct labeling even if other pipe-delimited annotations found in column 10
+	if "BeginSeg=Yes" in label:
+		return "BeginSeg=Yes"
+	elif "Seg=B-Conn" in label:
+		return "Seg=B-Conn"
+	elif "Seg=I-Conn" in label:
+		return "Seg=I-Conn"
+	return "_"
+
+
+class _UnderscoreTable(dict):
+	"""
+	str.translate table mapping every character to an underscore, except characters in keep
+	(or all whitespace if keep is None). Entries are filled in on first use.
+	"""
+
+	def __init__(self, keep=None):
+		super(_UnderscoreTable, self).__init__()
+		self.keep = keep
+
+	def __missing__(self, code):
+		char = chr(code)
+		kept = char.isspace() if self.keep is None else char in self.keep
+		self[code] = code if kept else "_"
+		return self[code]
+
+
+_BLANK_NON_SPACE = _UnderscoreTable()
+_BLANK_EXCEPT_SPACE = _UnderscoreTable(keep=" ")
+
+
+def underscore(text):
+	"""
+	Replace every non-whitespace character with an underscore, like re.sub(r'[^\s]','_',text)
+	"""
+	return text.translate(_BLANK_NON_SPACE)
+
+
+def underscore_rel(text):
+	"""
+	Replace every character except spaces with an underscore, keeping <*> discontinuity markers (.rels text fields)
+	"""
+	return "<*>".join(part.translate(_BLANK_EXCEPT_SPACE) for part in text.split("<*>"))
+
+
+def remove_whitespace(text):
+	"""
+	Remove all whitespace, like re.sub(r'\s','',text)
+	"""
+	return "".join(text.split())
+
+
+def read_lines(infile):
+	"""
+	Stream the lines of a file without line breaks. Whitespace at the beginning and end of the file is removed,
+	as if the whole file had been stripped, by holding back blank lines until a non-blank line follows.
+
+	:param infile: file to read
+	:return: generator of lines
+	"""
+	held = []
+	started = False
+	previous = None
+	with io.open(infile,encoding="utf8") as f:
+		for line in f:
+			line = line.rstrip("\n")
+			if line.strip() == "":
+				if started:
+					held.append(line)
+				continue
+			if not started:
+				line = line.lstrip()
+				started = True
+			if previous is not None:
+				yield previous
+			for blank in held:
+				yield blank
+			held = []
+			previous = line
+	if previous is not None:
+		yield previous.rstrip()
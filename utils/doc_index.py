@@ -0,0 +1,246 @@
+"""
+doc_index.py
+
+Document-level index of the .conllu, .tok and .rels files of a corpus, giving the byte ranges of each document in each
+file, so that scripts can read single documents without scanning files from the top:
+
+```
+from doc_index import load_index, read_doc
+index = load_index("../data/eng.rst.gum")
+text = read_doc("../data/eng.rst.gum/eng.rst.gum_dev.conllu", "GUM_academic_exposure", index)
+```
+
+The index is stored in the corpus directory as .doc_index.json. For each file, it records the size, modification
+time and SHA1 hash of the file (as in gold_cache.py) and, in file order, the documents with:
+
+  * ranges: list of [start, end) byte offsets of the document's lines; documents start at their # newdoc id comment
+    in .conllu and .tok files, and .rels files have one range per contiguous run of rows of the document
+  * tokens: number of tokens, not counting multiword token ranges and empty nodes (.conllu and .tok)
+  * sentences: number of sentences (.conllu)
+  * rows: number of relation instances (.rels)
+
+load_index reindexes files which were added or changed since the index was written.
+
+Arguments:
+ * corpus_dirs: one or more corpus directories to index (e.g. ../data/eng.rst.gum)
+ * -f/--file: print documents from this file instead of a summary of the index
+ * -d/--doc: document to print from --file (can be repeated; default: list the documents in the file)
+
+"""
+
+__license__ = "Apache 2.0"
+__version__ = "1.0.0"
+
+import io, os, sys, json
+from argparse import ArgumentParser
+from glob import glob
+
+from gold_cache import source_stamp, is_fresh, atomic_open
+
+INDEX_NAME = ".doc_index.json"
+FORMAT_VERSION = 1
+
+
+def index_path(corpus_dir):
+	return os.path.join(corpus_dir, INDEX_NAME)
+
+
+def corpus_files(corpus_dir):
+	return sorted(glob(os.path.join(corpus_dir, "*.conllu")) + glob(os.path.join(corpus_dir, "*.tok")) +
+				  glob(os.path.join(corpus_dir, "*.rels")))
+
+
+def index_conll(f, sentences=True):
+	"""
+	:param f: .conllu or .tok file opened in binary mode
+	:param sentences: if True, count sentences separated by blank lines
+	:return: dictionary of document names to index entries, in file order
+	"""
+	docs = {}
+	entry = None
+	in_sentence = False
+	offset = 0
+	for line in f:
+		if line.startswith(b"# newdoc id") and b"=" in line:  # Without "=" (e.g. # newdoc id: d1), it is a comment
+			if entry is not None:
+				entry["ranges"][-1][1] = offset
+			docname = line.decode("utf8").split("=", maxsplit=1)[1].strip()
+			entry = docs.setdefault(docname, {"ranges": [], "tokens": 0})
+			if sentences:
+				entry.setdefault("sentences", 0)
+			entry["ranges"].append([offset, offset])
+		elif entry is not None:
+			if line[:1].isdigit() and b"\t" in line:
+				tok_id = line.split(b"\t", 1)[0]
+				if b"-" not in tok_id and b"." not in tok_id:
+					entry["tokens"] += 1
+				if sentences and not in_sentence:
+					entry["sentences"] += 1
+				in_sentence = True
+			elif line.strip() == b"":
+				in_sentence = False
+		offset += len(line)
+	if entry is not None:
+		entry["ranges"][-1][1] = offset
+	return docs
+
+
+def index_rels(f):
+	"""
+	:param f: .rels file opened in binary mode
+	:return: dictionary of document names to index entries, in file order
+	"""
+	docs = {}
+	entry = None
+	last_doc = None
+	offset = 0
+	for l, line in enumerate(f):
+		if b"\t" in line and not (l == 0 and line.startswith(b"doc\t")):
+			docname = line.split(b"\t", 1)[0]
+			if docname != last_doc:
+				if entry is not None:
+					entry["ranges"][-1][1] = offset
+				entry = docs.setdefault(docname.decode("utf8"), {"ranges": [], "rows": 0})
+				entry["ranges"].append([offset, offset])
+				last_doc = docname
+			entry["rows"] += 1
+		offset += len(line)
+	if entry is not None:
+		entry["ranges"][-1][1] = offset
+	return docs
+
+
+def index_file(path):
+	"""
+	:param path: .conllu, .tok or .rels file
+	:return: index entry for the file, with "source" (size, mtime and hash) and "docs"
+	"""
+	stamp = source_stamp(path)
+	with io.open(path, "rb") as f:
+		if path.endswith(".rels"):
+			docs = index_rels(f)
+		else:
+			docs = index_conll(f, sentences=path.endswith(".conllu"))
+	return {"source": stamp, "docs": docs}
+
+
+def write_index(corpus_dir, files):
+	path = index_path(corpus_dir)
+	with atomic_open(path, "w", encoding="utf8", newline="\n") as f:
+		f.write(json.dumps({"version": FORMAT_VERSION, "files": files}, indent=1) + "\n")
+
+
+def build_index(corpus_dir):
+	"""
+	Index all .conllu, .tok and .rels files of a corpus and write the index
+
+	:param corpus_dir: corpus directory, e.g. ../data/eng.rst.gum
+	:return: dictionary of file names to index entries
+	"""
+	files = {os.path.basename(path): index_file(path) for path in corpus_files(corpus_dir)}
+	write_index(corpus_dir, files)
+	return files
+
+
+def load_index(corpus_dir):
+	"""
+	Load the index of a corpus, building it if needed and reindexing files which were added or changed since
+
+	:param corpus_dir: corpus directory, e.g. ../data/eng.rst.gum
+	:return: dictionary of file names to index entries
+	"""
+	files = None
+	if os.path.isfile(index_path(corpus_dir)):
+		with io.open(index_path(corpus_dir), encoding="utf8") as f:
+			index = json.load(f)
+		if index.get("version") == FORMAT_VERSION:
+			files = index["files"]
+	if files is None:
+		return build_index(corpus_dir)
+
+	changed = False
+	current = {}
+	for path in corpus_files(corpus_dir):
+		name = os.path.basename(path)
+		if name in files and is_fresh(files[name], path):
+			current[name] = files[name]
+		else:
+			current[name] = index_file(path)
+			changed = True
+	if changed or len(current) != len(files):
+		write_index(corpus_dir, current)
+	return current
+
+
+def doc_entry(path, docname, index=None):
+	"""
+	:param path: indexed .conllu, .tok or .rels file
+	:param docname: document name
+	:param index: index of the file's corpus from load_index, or None to load it
+	:return: index entry of the document
+	"""
+	if index is None:
+		index = load_index(os.path.dirname(path) or ".")
+	docs = index[os.path.basename(path)]["docs"]
+	if docname not in docs:
+		raise KeyError("! Document " + docname + " not found in " + os.path.basename(path))
+	return docs[docname]
+
+
+def read_doc(path, docname, index=None):
+	"""
+	Read the lines of one document, seeking directly to its byte ranges
+
+	:param path: indexed .conllu, .tok or .rels file
+	:param docname: document name
+	:param index: index of the file's corpus from load_index, or None to load it
+	:return: string with the document's lines, as they appear in the file
+	"""
+	chunks = []
+	with io.open(path, "rb") as f:
+		for start, end in doc_entry(path, docname, index)["ranges"]:
+			f.seek(start)
+			chunks.append(f.read(end - start))
+	return b"".join(chunks).decode("utf8")
+
+
+def read_docs(path, docnames, index=None):
+	"""
+	:param path: indexed .conllu, .tok or .rels file
+	:param docnames: document names
+	:param index: index of the file's corpus from load_index, or None to load it
+	:return: string with the lines of the documents in the given order, e.g. to evaluate or restore a subset with
+	         string_input
+	"""
+	if index is None:
+		index = load_index(os.path.dirname(path) or ".")
+	return "".join(read_doc(path, docname, index) for docname in docnames)
+
+
+if __name__ == "__main__":
+	p = ArgumentParser()
+	p.add_argument("corpus_dirs", nargs="+", help="Corpus directories to index, e.g. ../data/eng.rst.gum")
+	p.add_argument("-f", "--file", default=None, help="Print documents from this file instead of a summary")
+	p.add_argument("-d", "--doc", action="append", default=None, help="Document to print from --file")
+	opts = p.parse_args()
+
+	for corpus_dir in opts.corpus_dirs:
+		index = load_index(corpus_dir)
+		if opts.file is not None:
+			if os.path.basename(opts.file) not in index:
+				continue
+			if opts.doc is None:
+				for docname in index[os.path.basename(opts.file)]["docs"]:
+					print(docname)
+			else:
+				try:
+					sys.stdout.write(read_docs(os.path.join(corpus_dir, os.path.basename(opts.file)), opts.doc, index))
+				except KeyError as e:
+					sys.stderr.write(e.args[0] + "\n")
+					sys.exit(1)
+			continue
+		for name, entry in index.items():
+			docs = entry["docs"].values()
+			print("o " + name + ": " + str(len(docs)) + " documents, " +
+				  str(sum(doc.get("tokens", doc.get("rows", 0)) for doc in docs)) +
+				  (" relation instances" if name.endswith(".rels") else " tokens"))
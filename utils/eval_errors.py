@@ -0,0 +1,47 @@
+"""
+eval_errors.py
+
+Exceptions raised by the evaluation scripts (seg_eval.py, rel_eval.py) for prediction files which cannot be scored,
+so that they can be imported and called in-process (e.g. by eval_server.py) without exiting the interpreter.
+
+Every exception carries a report dictionary with structured details of the problem, in addition to the message
+printed by the command line scripts. For token and label count mismatches, the report contains:
+
+  * file: name of the gold file
+  * gold_count, pred_count: number of tokens or relation instances in gold and pred
+  * first_mismatch: dictionary describing the first position at which gold and pred diverge, with the keys
+    index (position in the file), doc (gold document name, if known), doc_offset (position in that document),
+    gold and pred (token strings or labels at that position, None if the file ended before it)
+
+"""
+
+__license__ = "Apache 2.0"
+__version__ = "1.0.0"
+
+
+class EvaluationError(ValueError):
+	"""
+	Base class for prediction files which cannot be scored against their gold file
+	"""
+
+	def __init__(self, message, report=None):
+		super(EvaluationError, self).__init__(message)
+		self.report = report if report is not None else {}
+
+	def summary(self):
+		"""
+		:return: the message on a single line, e.g. for tables of results
+		"""
+		return " ".join(str(self).split())
+
+
+class TokenCountMismatch(EvaluationError):
+	"""
+	Gold and predicted .tok/.conllu files have different numbers of tokens
+	"""
+
+
+class LabelCountMismatch(EvaluationError):
+	"""
+	Gold and predicted .rels files have different numbers of relation instances
+	"""
@@ -0,0 +1,236 @@
+"""
+eval_server.py
+
+Script to run a persistent local evaluation server, which keeps parsed gold files in memory so that repeated
+evaluations (e.g. of dev predictions after every training checkpoint) do not need to re-read and re-parse gold data.
+
+Gold files are cached in a least recently used (LRU) cache with an approximate memory cap, and are re-read
+automatically if they change on disk. Scores are identical to those of seg_eval.py and rel_eval.py.
+
+The server listens on localhost and accepts JSON POST requests to /score:
+
+```
+{"gold": "../data/eng.rst.gum/eng.rst.gum_dev.tok", "pred": "/path/to/predictions.tok"}
+```
+
+Instead of "pred", "pred_string" may be used to submit the contents of the prediction file directly.
+GET /stats returns the cache state. Use request_scores() from this module to query a running server from Python.
+
+Arguments:
+ * -p/--port: port to listen on (default: 8765)
+ * -m/--max_mb: approximate memory cap for cached gold data in MB (default: 1024)
+ * --preload: parse all dev and test gold files in the data directory at startup
+ * -d/--data_dir: data directory for --preload (default: ../data)
+
+"""
+
+__license__ = "Apache 2.0"
+__version__ = "1.0.0"
+
+import os, sys, json, threading
+from argparse import ArgumentParser
+from collections import OrderedDict
+from glob import glob
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.error import HTTPError
+from urllib.request import Request, urlopen
+
+from seg_eval import iter_data, doc_records, score_records
+from rel_eval import parse_data as parse_rels, check_counts, score_labels
+from eval_errors import EvaluationError
+
+
+def load_gold(gold_file):
+	"""
+	Parse a gold file into the form kept in the cache
+
+	:param gold_file: path to a .tok, .conllu or .rels gold file
+	:return: dictionary with the parsed data and its approximate size in bytes
+	"""
+	if gold_file.endswith(".rels"):
+		labels = [sys.intern(label) for label in parse_rels(gold_file)]
+		size = 8 * len(labels) + sum(sys.getsizeof(label) for label in set(labels))
+		return {"kind": "rel", "path": gold_file, "labels": labels, "size": size}
+
+	tokens = []
+	labels = []
+	doc_names = []
+	doc_starts = []
+	for docname, token, label in iter_data(gold_file, docs=True):
+		if len(doc_names) == 0 or docname != doc_names[-1]:
+			doc_names.append(docname)
+			doc_starts.append(len(tokens))
+		tokens.append(token)
+		labels.append(label)  # Normalized labels are shared constants
+	size = 16 * len(tokens) + sum(sys.getsizeof(token) for token in tokens)
+	return {"kind": "seg", "path": gold_file, "tokens": tokens, "labels": labels, "doc_names": doc_names,
+			"doc_starts": doc_starts, "size": size}
+
+
+class GoldCache(object):
+	"""
+	Thread-safe LRU cache of parsed gold files, keyed by absolute path and invalidated by size and mtime
+	"""
+
+	def __init__(self, max_bytes):
+		self.max_bytes = max_bytes
+		self.total_bytes = 0
+		self.entries = OrderedDict()
+		self.hits = 0
+		self.misses = 0
+		self.lock = threading.Lock()
+
+	def get(self, gold_file):
+		"""
+		:param gold_file: path to a gold file
+		:return: parsed gold data, as returned by load_gold
+		"""
+		key = os.path.abspath(gold_file)
+		stat = os.stat(key)
+		stamp = (stat.st_size, stat.st_mtime)
+		with self.lock:
+			entry = self.entries.get(key)
+			if entry is not None and entry["stamp"] == stamp:
+				self.entries.move_to_end(key)
+				self.hits += 1
+				return entry
+		entry = load_gold(key)
+		entry["stamp"] = stamp
+		with self.lock:
+			self.misses += 1
+			if key in self.entries:
+				self.total_bytes -= self.entries.pop(key)["size"]
+			self.entries[key] = entry
+			self.total_bytes += entry["size"]
+			while self.total_bytes > self.max_bytes and len(self.entries) > 1:  # Evict least recently used
+				_, evicted = self.entries.popitem(last=False)
+				self.total_bytes -= evicted["size"]
+		return entry
+
+	def stats(self):
+		with self.lock:
+			return {"files": list(self.entries.keys()), "total_bytes": self.total_bytes,
+					"max_bytes": self.max_bytes, "hits": self.hits, "misses": self.misses}
+
+
+def score_submission(cache, gold_file, pred_file=None, pred_string=None):
+	"""
+	Score a prediction against a cached gold file
+
+	:param cache: GoldCache instance
+	:param gold_file: path to the gold file
+	:param pred_file: path to the prediction file
+	:param pred_string: contents of the prediction file, used instead of pred_file if given
+	:return: dictionary of scores, in the same format as seg_eval.get_scores or rel_eval.get_accuracy_score
+	"""
+	string_input = pred_string is not None
+	pred = pred_string if string_input else pred_file
+	return score_gold(cache.get(gold_file), os.path.basename(gold_file), pred, string_input)
+
+
+def score_gold(gold, gold_name, pred, string_input=False):
+	"""
+	Score a prediction against gold data which has already been parsed
+
+	:param gold: parsed gold data, as returned by load_gold
+	:param gold_name: file name of the gold data for reports
+	:param pred: path to the prediction file, or its contents if string_input is True
+	:param string_input: If True, pred is a string with file contents instead of a file name
+	:return: dictionary of scores, in the same format as seg_eval.get_scores or rel_eval.get_accuracy_score
+	:raises EvaluationError: if the prediction cannot be scored against the gold data (see eval_errors.py)
+	"""
+	if gold["kind"] == "rel":
+		pred_labels = parse_rels(pred, string_input)
+		check_counts(gold["labels"], pred_labels, gold_name, gold["path"])
+		acc, confusion, label_scores = score_labels(gold["labels"], pred_labels)
+		return {"filename": gold_name, "acc_score": acc, "gold_rel_count": len(gold["labels"]),
+				"pred_rel_count": len(pred_labels), "confusion": confusion, "label_scores": label_scores}
+
+	gold_records = doc_records(gold["doc_names"], gold["doc_starts"], gold["tokens"], gold["labels"])
+	return score_records(gold_records, iter_data(pred, string_input), gold_name)
+
+
+def request_scores(gold_file, pred_file=None, pred_string=None, host="127.0.0.1", port=8765):
+	"""
+	Client helper to get scores from a running evaluation server
+
+	:return: dictionary of scores; raises EvaluationError for predictions which cannot be scored, or ValueError if the
+	         server rejected the submission for another reason
+	"""
+	payload = {"gold": os.path.abspath(gold_file)}
+	if pred_string is not None:
+		payload["pred_string"] = pred_string
+	else:
+		payload["pred"] = os.path.abspath(pred_file)
+	request = Request("http://" + host + ":" + str(port) + "/score", data=json.dumps(payload).encode("utf8"),
+					  headers={"Content-Type": "application/json"})
+	try:
+		return json.loads(urlopen(request).read().decode("utf8"))
+	except HTTPError as e:
+		response = json.loads(e.read().decode("utf8"))
+		if "report" in response:
+			raise EvaluationError(response["error"], response["report"])
+		raise ValueError(response["error"])
+
+
+class EvalHandler(BaseHTTPRequestHandler):
+	cache = None
+
+	def send_json(self, status, obj):
+		body = json.dumps(obj).encode("utf8")
+		self.send_response(status)
+		self.send_header("Content-Type", "application/json")
+		self.send_header("Content-Length", str(len(body)))
+		self.end_headers()
+		self.wfile.write(body)
+
+	def do_GET(self):
+		if self.path == "/stats":
+			self.send_json(200, self.cache.stats())
+		else:
+			self.send_json(404, {"error": "unknown path " + self.path})
+
+	def do_POST(self):
+		if self.path != "/score":
+			self.send_json(404, {"error": "unknown path " + self.path})
+			return
+		try:
+			length = int(self.headers.get("Content-Length", 0))
+			payload = json.loads(self.rfile.read(length).decode("utf8"))
+			scores = score_submission(self.cache, payload["gold"], payload.get("pred"), payload.get("pred_string"))
+		except EvaluationError as e:
+			self.send_json(400, {"error": e.summary(), "report": e.report})
+			return
+		except (KeyError, ValueError, IOError) as e:
+			self.send_json(400, {"error": repr(e)})
+			return
+		self.send_json(200, scores)
+
+	def log_message(self, format, *args):
+		pass
+
+
+if __name__ == "__main__":
+	p = ArgumentParser()
+	p.add_argument("-p", "--port", type=int, default=8765, help="Port to listen on at localhost")
+	p.add_argument("-m", "--max_mb", type=int, default=1024, help="Approximate memory cap for cached gold data in MB")
+	p.add_argument("--preload", action="store_true", help="Parse all dev and test gold files at startup")
+	p.add_argument("-d", "--data_dir", default=os.sep.join(["..", "data"]), help="Data directory for --preload")
+
+	opts = p.parse_args()
+
+	EvalHandler.cache = GoldCache(opts.max_mb * 1024 * 1024)
+	if opts.preload:
+		for partition in ["dev", "test"]:
+			for ext in ["tok", "conllu", "rels"]:
+				for gold_file in sorted(glob(os.sep.join([opts.data_dir, "*", "*_" + partition + "." + ext]))):
+					EvalHandler.cache.get(gold_file)
+		stats = EvalHandler.cache.stats()
+		sys.stderr.write("o Preloaded " + str(len(stats["files"])) + " gold files (" + str(stats["total_bytes"] // (1024 * 1024)) + " MB)\n")
+
+	server = ThreadingHTTPServer(("127.0.0.1", opts.port), EvalHandler)
+	sys.stderr.write("o Evaluation server listening on 127.0.0.1:" + str(opts.port) + "\n")
+	try:
+		server.serve_forever()
+	except KeyboardInterrupt:
+		server.server_close()
@@ -0,0 +1,241 @@
+"""
+gold_cache.py
+
+Binary sidecar files holding pre-parsed gold data for seg_eval.py and rel_eval.py, so that repeated evaluations
+against the same gold file can skip parsing the CoNLL-U/.rels text.
+
+A sidecar is written next to each gold file with the extension .gcache added (e.g. eng.rst.gum_dev.tok.gcache).
+It contains a small JSON header followed by raw arrays, each aligned to 8 bytes, which are memory-mapped on loading
+and exposed as zero-copy memoryviews:
+
+  * .tok/.conllu: label codes (see seg_eval.LABEL_CODES), connective span boundaries, token strings and the
+    index of the first token of each document
+  * .rels: label codes, with the label inventory stored in the header
+
+seg_eval.score_cached scores directly from the label codes and spans, and compares the predicted tokens with the
+UTF-8 token section as a whole; token strings are only decoded (see decode_tokens) to report a mismatch. rel_eval
+maps the label codes back to label strings.
+
+The header records the size, modification time and SHA1 hash of the source file. A sidecar is used if size and mtime
+match, or if only the mtime changed but the content hash is identical; otherwise it is rebuilt automatically.
+
+"""
+
+__license__ = "Apache 2.0"
+__version__ = "1.0.0"
+
+import io, os, json, mmap, hashlib, tempfile, contextlib
+from array import array
+
+MAGIC = b"DISRPTGC"
+FORMAT_VERSION = 1
+SUFFIX = ".gcache"
+
+
+def sidecar_path(gold_file):
+	return gold_file + SUFFIX
+
+
+def file_hash(path):
+	sha1 = hashlib.sha1()
+	with io.open(path, "rb") as f:
+		for chunk in iter(lambda: f.read(1 << 20), b""):
+			sha1.update(chunk)
+	return sha1.hexdigest()
+
+
+def source_stamp(gold_file, with_hash=True):
+	"""
+	:return: dictionary with size, mtime and optionally the SHA1 hash of the source file
+	"""
+	stat = os.stat(gold_file)
+	stamp = {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns}
+	if with_hash:
+		stamp["sha1"] = file_hash(gold_file)
+	return stamp
+
+
+@contextlib.contextmanager
+def atomic_open(path, mode="wb", **kwargs):
+	"""
+	Open a unique temporary file next to path for writing, and move it into place when the block completes. Concurrent
+	writers of the same path (e.g. sweep processes rebuilding the same stale cache) each write their own file, so
+	readers only ever see a complete file; if the block raises, the temporary file is removed.
+
+	:param path: output path
+	:param mode: "wb" or "w"
+	:param kwargs: further arguments for io.open, e.g. encoding
+	:return: context manager yielding the open temporary file
+	"""
+	fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path) or ".", prefix=os.path.basename(path) + ".", suffix=".tmp")
+	try:
+		with io.open(fd, mode, **kwargs) as f:
+			yield f
+		os.chmod(tmp_path, 0o644)  # mkstemp files are only readable by their owner
+		os.replace(tmp_path, path)
+	except BaseException:
+		os.remove(tmp_path)
+		raise
+
+
+def write_sidecar(path, header, sections):
+	"""
+	Write a sidecar file
+
+	:param path: output path
+	:param header: JSON-serializable dictionary of metadata
+	:param sections: dictionary of section name -> array.array
+	"""
+	header = dict(header)
+	header["version"] = FORMAT_VERSION
+	header["sections"] = {}
+	# Compute offsets with a placeholder header, then pad the header to a fixed size
+	payload = []
+	offset = 0
+	for name, arr in sections.items():
+		data = arr.tobytes()
+		header["sections"][name] = [offset, len(arr), arr.typecode]
+		payload.append(data + b"\0" * (-len(data) % 8))
+		offset += len(payload[-1])
+	header_bytes = json.dumps(header).encode("utf8")
+	header_bytes += b" " * (-(len(MAGIC) + 8 + len(header_bytes)) % 8)
+	with atomic_open(path) as f:
+		f.write(MAGIC)
+		f.write(len(header_bytes).to_bytes(8, "little"))
+		f.write(header_bytes)
+		for data in payload:
+			f.write(data)
+
+
+def read_sidecar(path):
+	"""
+	Memory-map a sidecar file
+
+	:param path: sidecar path
+	:return: tuple of header dictionary and dictionary of section name -> memoryview, or (None, None) if unreadable
+	"""
+	with io.open(path, "rb") as f:
+		if f.read(len(MAGIC)) != MAGIC:
+			return None, None
+		header_len = int.from_bytes(f.read(8), "little")
+		header = json.loads(f.read(header_len).decode("utf8"))
+		if header.get("version") != FORMAT_VERSION:
+			return None, None
+		data_start = len(MAGIC) + 8 + header_len
+		mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+	view = memoryview(mapped)
+	sections = {}
+	for name, (offset, length, typecode) in header["sections"].items():
+		itemsize = array(typecode).itemsize
+		start = data_start + offset
+		sections[name] = view[start:start + length * itemsize].cast(typecode)
+	return header, sections
+
+
+def build_seg_sections(gold_file):
+	from seg_eval import iter_data, LABEL_CODES, SpanTracker
+
+	labels = array("b")
+	spans = array("i")
+	doc_starts = array("i")
+	doc_names = []
+	tokens = []
+	tracker = SpanTracker()
+	last_doc = None
+	for docname, token, label in iter_data(gold_file, docs=True):
+		if docname != last_doc or len(doc_names) == 0:
+			doc_names.append(docname)
+			doc_starts.append(len(tokens))
+			last_doc = docname
+		span = tracker.update(label)
+		if span is not None:
+			spans.extend(span)
+		labels.append(LABEL_CODES[label])
+		tokens.append(token)
+	span = tracker.close()
+	if span is not None:
+		spans.extend(span)
+
+	token_bytes = array("B", "\n".join(tokens).encode("utf8"))
+	header = {"kind": "seg", "doc_names": doc_names}
+	return header, {"labels": labels, "spans": spans, "doc_starts": doc_starts, "tokens": token_bytes}
+
+
+def build_rel_sections(gold_file):
+	from rel_eval import parse_data
+
+	vocab = {}
+	labels = array("H")
+	for label in parse_data(gold_file):
+		if label not in vocab:
+			vocab[label] = len(vocab)
+		labels.append(vocab[label])
+	header = {"kind": "rel", "label_names": list(vocab)}
+	return header, {"labels": labels}
+
+
+def build_sidecar(gold_file):
+	"""
+	Parse a gold file and write its sidecar
+	"""
+	stamp = source_stamp(gold_file)
+	if gold_file.endswith(".rels"):
+		header, sections = build_rel_sections(gold_file)
+	else:
+		header, sections = build_seg_sections(gold_file)
+	header["source"] = stamp
+	write_sidecar(sidecar_path(gold_file), header, sections)
+
+
+def is_fresh(header, gold_file):
+	"""
+	Check whether a sidecar header still describes the gold file on disk
+	"""
+	if header is None:
+		return False
+	source = header["source"]
+	stamp = source_stamp(gold_file, with_hash=False)
+	if stamp["size"] != source["size"]:
+		return False
+	if stamp["mtime_ns"] == source["mtime_ns"]:
+		return True
+	return file_hash(gold_file) == source["sha1"]  # Touched but possibly unchanged
+
+
+def load_cached(gold_file):
+	"""
+	Load pre-parsed gold data from its sidecar, building or rebuilding the sidecar first if needed
+
+	:param gold_file: path to a .tok, .conllu or .rels gold file
+	:return: dictionary with "kind" ("seg" or "rel") and "labels" (memoryview of label codes); for "seg" also
+	         "tokens" (memoryview of the newline-separated UTF-8 token strings), "spans" (memoryview of flattened
+	         (start, end) pairs), "doc_names" and "doc_starts" (memoryview); for "rel" also "label_names" mapping
+	         codes to label strings
+	"""
+	path = sidecar_path(gold_file)
+	header = None
+	if os.path.isfile(path):
+		header, sections = read_sidecar(path)
+	if not is_fresh(header, gold_file):
+		build_sidecar(gold_file)
+		header, sections = read_sidecar(path)
+
+	gold = {"kind": header["kind"], "labels": sections["labels"]}
+	if header["kind"] == "rel":
+		gold["label_names"] = header["label_names"]
+	else:
+		gold["spans"] = sections["spans"]
+		gold["tokens"] = sections["tokens"]
+		gold["doc_names"] = header["doc_names"]
+		gold["doc_starts"] = sections["doc_starts"]
+	return gold
+
+
+def decode_tokens(gold):
+	"""
+	:param gold: "seg" gold data as returned by load_cached
+	:return: list of token strings
+	"""
+	if len(gold["labels"]) == 0:
+		return []
+	return bytes(gold["tokens"]).decode("utf8").split("\n")
@@ -0,0 +1,122 @@
+"""
+multi_eval.py
+
+Script to score several system predictions (e.g. different checkpoints) against the same gold file and print a
+leaderboard, using the same scoring as seg_eval.py and rel_eval.py.
+
+The gold file is parsed only once and shared by all scoring workers, so that the cost of scoring N systems grows with
+the time to parse N prediction files rather than N pairs of gold and prediction files. Prediction files are scored in
+parallel worker processes (or threads with -t), and systems with malformed predictions are listed with an error.
+
+Example:
+
+```
+python multi_eval.py ../data/eng.rst.gum/eng.rst.gum_dev.tok checkpoints/*/eng.rst.gum_dev.tok
+```
+
+Arguments:
+ * goldfile: shared task gold file (.tok, .conllu or .rels)
+ * predfiles: one or more prediction files in the same format
+ * -o/--outfile: output table; .json for JSON, anything else for TSV (default: print TSV to stdout)
+ * -j/--jobs: number of parallel workers (default: number of cores)
+ * -t/--threads: use threads instead of worker processes
+
+"""
+
+__license__ = "Apache 2.0"
+__version__ = "1.0.0"
+
+import os, sys
+from argparse import ArgumentParser
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+from batch_eval import write_results
+from eval_server import load_gold, score_gold
+from eval_errors import EvaluationError
+
+COLUMNS = ["rank", "system", "tok_count", "gold_count", "pred_count", "prec", "rec", "f_score", "acc", "error"]
+
+_gold = None  # Parsed gold data in worker processes, set once per worker by init_worker
+
+
+def init_worker(gold):
+	global _gold
+	_gold = gold
+
+
+def score_system(job):
+	"""
+	Score one prediction file against the shared parsed gold data
+
+	:param job: tuple of (gold file name, prediction file path)
+	:return: dictionary with one row of the leaderboard, without rank
+	"""
+	gold_name, pred_file = job
+	row = {col: None for col in COLUMNS}
+	row["system"] = pred_file
+	try:
+		score_dict = score_gold(_gold, gold_name, pred_file)
+	except EvaluationError as e:
+		row["error"] = e.summary()
+		return row
+	except (IOError, ValueError) as e:
+		row["error"] = repr(e)
+		return row
+	if _gold["kind"] == "rel":
+		row["gold_count"] = score_dict["gold_rel_count"]
+		row["pred_count"] = score_dict["pred_rel_count"]
+		row["acc"] = score_dict["acc_score"]
+	else:
+		row["tok_count"] = score_dict["tok_count"]
+		row["gold_count"] = score_dict["gold_seg_count"]
+		row["pred_count"] = score_dict["pred_seg_count"]
+		row["prec"] = score_dict["prec"]
+		row["rec"] = score_dict["rec"]
+		row["f_score"] = score_dict["f_score"]
+	return row
+
+
+def score_systems(gold_file, pred_files, jobs=None, threads=False):
+	"""
+	Score several prediction files against one gold file, parsing the gold file only once
+
+	:param gold_file: path to a .tok, .conllu or .rels gold file
+	:param pred_files: list of prediction file paths
+	:param jobs: number of parallel workers, 1 to score in the current process, or None to use all cores
+	:param threads: if True, use threads instead of worker processes
+	:return: list of leaderboard rows, best system first (by f-score, or accuracy for .rels), failed systems last
+	"""
+	gold = load_gold(gold_file)
+	gold_name = os.path.basename(gold_file)
+	score_jobs = [(gold_name, pred_file) for pred_file in pred_files]
+	if jobs == 1 or len(score_jobs) < 2:
+		init_worker(gold)
+		rows = [score_system(job) for job in score_jobs]
+	elif threads:
+		init_worker(gold)
+		with ThreadPoolExecutor(max_workers=jobs) as executor:
+			rows = list(executor.map(score_system, score_jobs))
+	else:
+		with ProcessPoolExecutor(max_workers=jobs, initializer=init_worker, initargs=(gold,)) as executor:
+			rows = list(executor.map(score_system, score_jobs))
+
+	metric = "acc" if gold["kind"] == "rel" else "f_score"
+	rows.sort(key=lambda row: (row["error"] is not None, -(row[metric] or 0)))
+	for rank, row in enumerate(rows):
+		row["rank"] = rank + 1 if row["error"] is None else None
+	return rows
+
+
+if __name__ == "__main__":
+	p = ArgumentParser()
+	p.add_argument("goldfile", help="Shared task gold file in .tok, .conllu or .rels format")
+	p.add_argument("predfiles", nargs="+", help="Prediction files of the systems to compare")
+	p.add_argument("-o", "--outfile", default=None, help="Output file (.json or .tsv); prints TSV if not given")
+	p.add_argument("-j", "--jobs", type=int, default=None, help="Number of parallel workers (default: all cores)")
+	p.add_argument("-t", "--threads", action="store_true", help="Use threads instead of worker processes")
+
+	opts = p.parse_args()
+
+	rows = score_systems(opts.goldfile, opts.predfiles, opts.jobs, opts.threads)
+	write_results(rows, opts.outfile, COLUMNS)
+	sys.stderr.write("o Scored " + str(len(rows)) + " systems, " + str(len([r for r in rows if r["error"]])) + " errors\n")
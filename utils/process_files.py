@@ -16,66 +16,44 @@ Other types of comments are deleted from original treebanks.
 
 If the plain (-p) option is used, a plain version without sentence and tree information is also outputted
 
+Use --profile to print stage timing and memory as JSON to stderr, or to write it to a file given after the flag
+(see stage_profile.py)
+
 """
 
 __author__ = "Amir Zeldes"
 __license__ = "Apache 2.0"
 __version__ = "1.0.1"
 
-import io, sys, os, re
+import io, sys, os
 from argparse import ArgumentParser
 from glob import glob
+from concurrent.futures import ProcessPoolExecutor
 
-p = ArgumentParser()
-p.add_argument("files",help="A glob pattern with files to process")
-p.add_argument("-p","--plain",action="store_true",help="Also output plain text version")
-p.add_argument("-s","--sample",action="store_true",help="Set outfile names to sample.tok and sample.conll")
-p.add_argument("-c","--corpus",action="store",help="Corpus name to output",default=None)
+from conll_lines import classify, TOKEN, COMMENT, BLANK, KEPT_COMMENT_RE, read_lines
+from stage_profile import stage, count, collect, add_profile_args, enable_profile
 
-opts = p.parse_args()
 
-files = glob(opts.files)
-last_line = ""
-multitoken = False
+def clean_lines(lines):
+	"""
+	Clean a stream of CoNLL-U lines
 
-for infile in files:
-	sys.stderr.write("i Processing file " + os.path.basename(infile) + "\n")
-	docids = False
+	:param lines: iterable of lines without line breaks
+	:return: generator of (target, line) tuples, where target is "conll" for lines of the cleaned treebank
+	         and "plain" for lines of the plain .tok version
+	"""
 	firstdoc = True
-	output = []
-	plain_output = []
 	token_counter = 0
-	outfile = os.path.basename(infile)
-	name_parts = outfile.rsplit(".",1)
-	if len(name_parts) > 1:
-		extension = name_parts[-1]
-		outfile = name_parts[0]
-	else:
-		extension = "conll"
-	outfile = outfile + "_clean." + extension
-	plainfile = outfile + "_plain.tok"
-	if opts.sample:
-		outfile = "sample.conll"
-		plainfile = "sample.tok"
-	if opts.corpus is not None:
-		outfile = opts.corpus
-		if "_dev" in infile:
-			outfile += "_dev"
-		elif "_test" in infile:
-			outfile += "_test"
-		else:
-			outfile += "_train"
-		plainfile = outfile + ".tok"
-		outfile += ".conll"
-	lines = io.open(infile,encoding="utf8").read().strip().replace("\r","\n").split("\n")
+	last_line = ""
 	for i, line in enumerate(lines):
-		if "\t" in line:  # Token line
+		kind = classify(line)
+		if kind == TOKEN:  # Token line
 			token_counter += 1
 			fields = line.split("\t")
 			multitoken = "-"  in fields[0]
 			if len(fields) != 10:
 				raise IOError("x Token line must contain 10 fields but " + str(len(fields)) + " found on line " + str(i) + "\n")
-			output.append(line)
+			yield "conll", line
 			fields[0] = str(token_counter)
 			fields[2:] = ["_"] * 8
 			if "BeginSeg=Yes" in line:
@@ -85,38 +63,151 @@ for infile in files:
 			if "Seg=I-Conn" in line:
 				fields[9] = "Seg=I-Conn"
 			if not multitoken:  # No multitokens in .tok files
-				plain_output.append("\t".join(fields))
+				yield "plain", "\t".join(fields)
 		else:
-			if line.startswith("#"):
-				m = re.match(r'# ?(newdoc id|sent_id|text) ?= ?(.+)',line)
+			if kind == COMMENT:
+				m = KEPT_COMMENT_RE.match(line)
 				if m is not None:
-					docids = True
-					outline = "# " + m.group(1) + " = " + m.group(2)
 					if m.group(1) == "newdoc id":
 						if not firstdoc:
-							plain_output.append("")
+							yield "plain", ""
 							if not last_line == "":  # Make sure there is a blank line between documents
-								output.append("")
+								yield "conll", ""
 						else:
 							firstdoc = False
-						plain_output.append(line)
+						yield "plain", line
 						token_counter = 0
-					output.append(line)
-			elif len(line.strip()) == 0:
+					yield "conll", line
+			elif kind == BLANK:
 				if last_line.strip() != "":
-					output.append("")
+					yield "conll", ""
 
 		last_line = line.strip()
 
+
+def output_names(infile, sample=False, corpus=None):
+	"""
+	:param infile: input treebank file
+	:param sample: if True, use sample.conll and sample.tok
+	:param corpus: corpus name to use for output files, with the partition (_train/_dev/_test) taken from infile
+	:return: tuple of output file names for the cleaned treebank and the plain .tok version
+	"""
+	outfile = os.path.basename(infile)
+	name_parts = outfile.rsplit(".",1)
+	if len(name_parts) > 1:
+		extension = name_parts[-1]
+		outfile = name_parts[0]
+	else:
+		extension = "conll"
+	outfile = outfile + "_clean." + extension
+	plainfile = outfile + "_plain.tok"
+	if sample:
+		outfile = "sample.conll"
+		plainfile = "sample.tok"
+	if corpus is not None:
+		outfile = corpus
+		if "_dev" in infile:
+			outfile += "_dev"
+		elif "_test" in infile:
+			outfile += "_test"
+		else:
+			outfile += "_train"
+		plainfile = outfile + ".tok"
+		outfile += ".conll"
+	return outfile, plainfile
+
+
+def clean_file(infile, outfile, plainfile=None):
+	"""
+	Clean one treebank file. Outputs are streamed to temporary files, which replace outfile and plainfile
+	once the whole input has been processed.
+
+	:param infile: input treebank in CoNLL-U format
+	:param outfile: output file for the cleaned treebank
+	:param plainfile: output file for the plain .tok version, or None to skip it
+	:return: True if the file contained document or sentence ID comments
+	"""
+	sys.stderr.write("i Processing file " + os.path.basename(infile) + "\n")
+	docids = False
+	written = {"conll": 0, "plain": 0}
+	out = {"conll": io.open(outfile + ".tmp",'w',encoding="utf8",newline="\n")}
+	if plainfile is not None:
+		out["plain"] = io.open(plainfile + ".tmp",'w',encoding="utf8",newline="\n")
+	try:
+		# Reading, cleaning and writing are streamed, unless profiling separates them
+		cleaned = collect("clean", clean_lines(collect("read", read_lines(infile))))
+		with stage("write"):
+			for target, line in cleaned:
+				if target in out:
+					out[target].write(line + "\n")
+					written[target] += 1
+				if target == "conll" and line.startswith("#"):
+					docids = True
+			for target in out:
+				if written[target] == 0:
+					out[target].write("\n")
+			count("conll_lines", written["conll"])
+			count("plain_lines", written["plain"])
+	except:
+		for target in out:
+			out[target].close()
+			os.remove(out[target].name)
+		raise
+	for target in out:
+		out[target].close()
+	os.replace(outfile + ".tmp", outfile)
+	if plainfile is not None:
+		os.replace(plainfile + ".tmp", plainfile)
+
 	if not docids:
 		sys.stderr.write("i No newdoc IDs in file " + os.path.basename(infile) + "\n")
+	return docids
+
+
+def clean_job(job):
+	return clean_file(*job)
+
+
+def clean_files(files, plain=False, sample=False, corpus=None, jobs=1):
+	"""
+	Clean several treebank files, optionally in parallel worker processes.
+
+	Files are processed in sorted order. If several inputs map to the same output names (e.g. with sample or corpus),
+	only the last of them is cleaned, since it would overwrite the others in a sequential run.
+
+	:param files: list of input files
+	:param plain: also output the plain .tok version
+	:param sample: if True, use sample.conll and sample.tok as output names
+	:param corpus: corpus name to use for output files
+	:param jobs: number of worker processes; 1 to clean in the current process, None for all cores
+	:return: list of (infile, outfile, plainfile) jobs that were run
+	"""
+	targets = {}
+	for infile in sorted(files):
+		outfile, plainfile = output_names(infile, sample, corpus)
+		targets[outfile] = (infile, outfile, plainfile if plain else None)
+	clean_jobs = sorted(targets.values())
+	if jobs == 1 or len(clean_jobs) < 2:
+		for job in clean_jobs:
+			clean_job(job)
+	else:
+		with ProcessPoolExecutor(max_workers=jobs) as executor:
+			list(executor.map(clean_job, clean_jobs))
+	return clean_jobs
+
 
-	with io.open(outfile,'w',encoding="utf8",newline="\n") as f:
-		f.write("\n".join(output) + "\n")
+if __name__ == "__main__":
+	p = ArgumentParser()
+	p.add_argument("files",help="A glob pattern with files to process")
+	p.add_argument("-p","--plain",action="store_true",help="Also output plain text version")
+	p.add_argument("-s","--sample",action="store_true",help="Set outfile names to sample.tok and sample.conll")
+	p.add_argument("-c","--corpus",action="store",help="Corpus name to output",default=None)
+	p.add_argument("-j","--jobs",action="store",type=int,default=1,help="Number of files to clean in parallel (0 = all cores)")
+	add_profile_args(p)
 
-	if opts.plain:
-		with io.open(plainfile,'w',encoding="utf8",newline="\n") as f:
-			f.write("\n".join(plain_output) + "\n")
+	opts = p.parse_args()
+	enable_profile("process_files", opts.profile, opts.profile_stage)
 
+	clean_files(glob(opts.files), opts.plain, opts.sample, opts.corpus, opts.jobs if opts.jobs > 0 else None)
 
-sys.stderr.write("Done.\n")
\ No newline at end of file
+	sys.stderr.write("Done.\n")
@@ -4,6 +4,8 @@ process_underscores.py
 Script to handle licensed data for which underlying text cannot be posted online (e.g. LDC data).
 Users need a copy of the LDC distribution of an underlying resource to restore text in some of the corpora.
 
+Use --profile to print stage timing and memory as JSON to stderr, or to write it to a file given after the flag
+(see stage_profile.py)
 
 """
 
@@ -11,11 +13,22 @@ __author__ = "Amir Zeldes"
 __license__ = "Apache 2.0"
 __version__ = "2.0.0"
 
-import io, re, os, sys
+import io, re, os, sys, json, mmap, hashlib, shutil, tempfile
 from glob import glob
 from collections import defaultdict
+from collections.abc import Mapping
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
 from argparse import ArgumentParser
 
+from conll_lines import NEWDOC_RE, TEXT_RE, UNDERSCORED_TEXT_RE, underscore, underscore_rel, remove_whitespace
+from gold_cache import source_stamp, is_fresh, atomic_open
+from stage_profile import stage, count, collect, add_profile_args, enable_profile
+
+GUM_PROXY_URL = "https://corpling.uis.georgetown.edu/gum/fetch_text_proxy.py"
+PROXY_CACHE_NAME = ".gum_proxy_cache.tsv"
+LIST_NUMBER_RE = re.compile(r' [0-9]+\. ')
+WIKI_LINK_RE = re.compile(r'\[([^]]+)\]\([^)]+\)')
+
 PY3 = sys.version_info[0] == 3
 if not PY3:
 	input = raw_input
@@ -223,85 +236,126 @@ gum_docs = {
 	]
 }
 
-def underscore_files(filenames):
-	def underscore_rel_field(text):
-		blanked = []
-		text = text.replace("<*>","❤")
-		for c in text:
-			if c!="❤" and c!=" ":
-				blanked.append("_")
-			else:
-				blanked.append(c)
-		return "".join(blanked).replace("❤","<*>")
-
-	for f_path in filenames:
-		skiplen = 0
-		with io.open(f_path, 'r', encoding='utf8') as fin:
-			lines = fin.readlines()
-
-		with io.open(f_path, 'w', encoding='utf8', newline="\n") as fout:
-			output = []
-			if f_path.endswith(".rels"):
-				for l, line in enumerate(lines):
-					line = line.strip()
-					if "\t" in line and l > 0:
-						doc, unit1_toks, unit2_toks, unit1_txt, unit2_txt, s1_toks, s2_toks, unit1_sent, unit2_sent, direction, orig_label, label = line.split("\t")
-						if "GUM" in doc and "reddit" not in doc:
-							output.append(line)
-							continue
-						unit1_txt = underscore_rel_field(unit1_txt)
-						unit2_txt = underscore_rel_field(unit2_txt)
-						unit1_sent = underscore_rel_field(unit1_sent)
-						unit2_sent = underscore_rel_field(unit2_sent)
-						fields = doc, unit1_toks, unit2_toks, unit1_txt, unit2_txt, s1_toks, s2_toks, unit1_sent, unit2_sent, direction, orig_label, label
-						line = "\t".join(fields)
-					output.append(line)
+def underscore_lines(lines, rels=False):
+	"""
+	Replace text with underscores in the lines of one .conllu, .tok or .rels file
+
+	:param lines: iterable of stripped lines
+	:param rels: True for lines of a .rels file
+	:return: generator of output lines
+	"""
+	if rels:
+		for l, line in enumerate(lines):
+			if "\t" in line and l > 0:
+				doc, unit1_toks, unit2_toks, unit1_txt, unit2_txt, s1_toks, s2_toks, unit1_sent, unit2_sent, direction, orig_label, label = line.split("\t")
+				if "GUM" in doc and "reddit" not in doc:
+					yield line
+					continue
+				unit1_txt = underscore_rel(unit1_txt)
+				unit2_txt = underscore_rel(unit2_txt)
+				unit1_sent = underscore_rel(unit1_sent)
+				unit2_sent = underscore_rel(unit2_sent)
+				fields = doc, unit1_toks, unit2_toks, unit1_txt, unit2_txt, s1_toks, s2_toks, unit1_sent, unit2_sent, direction, orig_label, label
+				line = "\t".join(fields)
+			yield line
+		return
+
+	skiplen = 0
+	doc = ""
+	for line in lines:
+		if line.startswith("# newdoc id"):
+			doc = line.split("=",maxsplit=1)[1].strip()
+		if "GUM" in doc and "reddit" not in doc:
+			yield line
+			continue
+		if line.startswith("# text"):
+			m = UNDERSCORED_TEXT_RE.match(line)
+			if m is not None:
+				yield m.group(1) + underscore(m.group(2))
+		elif "\t" in line:
+			fields = line.split("\t")
+			tok_col, lemma_col = fields[1:3]
+			if lemma_col == tok_col:  # Delete lemma if identical to token
+				fields[2] = '_'
+			elif tok_col.lower() == lemma_col:
+				fields[2] = "*LOWER*"
+			if skiplen < 1:
+				fields[1] = len(tok_col)*'_'
 			else:
-				doc = ""
-				for line in lines:
-					line = line.strip()
-					if line.startswith("# newdoc id"):
-						doc = line.split("=",maxsplit=1)[1].strip()
-					if "GUM" in doc and "reddit" not in doc:
-						output.append(line)
-						continue
-					if line.startswith("# text"):
-						m = re.match(r'(# text ?= ?)(.+)',line)
-						if m is not None:
-							line = m.group(1) + re.sub(r'[^\s]','_',m.group(2))
-							output.append(line)
-					elif "\t" in line:
-						fields = line.split("\t")
-						tok_col, lemma_col = fields[1:3]
-						if lemma_col == tok_col:  # Delete lemma if identical to token
-							fields[2] = '_'
-						elif tok_col.lower() == lemma_col:
-							fields[2] = "*LOWER*"
-						if skiplen < 1:
-							fields[1] = len(tok_col)*'_'
-						else:
-							skiplen -=1
-						output.append("\t".join(fields))
-						if "-" in fields[0]:  # Multitoken
-							start, end = fields[0].split("-")
-							start = int(start)
-							end = int(end)
-							skiplen = end - start + 1
-					else:
-						output.append(line)
-			fout.write('\n'.join(output) + "\n")
+				skiplen -=1
+			yield "\t".join(fields)
+			if "-" in fields[0]:  # Multitoken
+				start, end = fields[0].split("-")
+				start = int(start)
+				end = int(end)
+				skiplen = end - start + 1
+		else:
+			yield line
 
 
-def get_no_space_strings(cache_dict):
-	import ast
+def underscore_file(f_path):
+	"""
+	Replace text with underscores in one file. The output is streamed to a temporary file next to the input,
+	which replaces the input only once it is complete, so that an interrupted run leaves the original file intact.
+
+	:param f_path: .conllu, .tok or .rels file
+	"""
+	tmp_path = f_path + ".tmp"
+	try:
+		with io.open(f_path, 'r', encoding='utf8') as fin, io.open(tmp_path, 'w', encoding='utf8', newline="\n") as fout:
+			written = False
+			lines = collect("read", (line.strip() for line in fin))
+			output = collect("underscore", underscore_lines(lines, f_path.endswith(".rels")))
+			with stage("write"):
+				for line in output:
+					fout.write(line + "\n")
+					written = True
+				if not written:
+					fout.write("\n")
+	except:
+		if os.path.exists(tmp_path):
+			os.remove(tmp_path)
+		raise
+	os.replace(tmp_path, f_path)
+
+
+def underscore_files(filenames, jobs=1):
+	"""
+	Replace text with underscores in several files, optionally in parallel worker processes
+
+	:param filenames: list of .conllu, .tok and .rels files
+	:param jobs: number of worker processes; 1 to process files in the current process, None for all cores
+	"""
+	if jobs == 1 or len(filenames) < 2:
+		for f_path in filenames:
+			underscore_file(f_path)
+	else:
+		with ProcessPoolExecutor(max_workers=jobs) as executor:
+			list(executor.map(underscore_file, filenames))
+
+
+def parse_post(json_result):
+	"""
+	:param json_result: proxy record of a reddit post or comment, a JSON list (or Python literal) of dictionaries
+	:return: dictionary of the first entry
+	"""
+	try:
+		return json.loads(json_result)[0]
+	except ValueError:  # Older proxy dumps contain Python literals instead of JSON
+		import ast
+		return ast.literal_eval(json_result)[0]
+
 
+def get_no_space_strings(cache_dict):
 	no_space_docs = defaultdict(str)
 
 	for doc in gum_docs:
+		chunks = []  # Joined once per document instead of concatenating strings for every post
+		length = 0
 		for post in gum_docs[doc]:
 			if post["id"] in cache_dict:
 				json_result = cache_dict[post["id"]]
-			parsed = ast.literal_eval(json_result)[0]
+			parsed = parse_post(json_result)
 			if post["type"]=="post":
 				plain = parsed["selftext"]
 				title = parsed["title"]
@@ -326,7 +380,7 @@ def get_no_space_strings(cache_dict):
 				plain = plain.replace("2. Using these","b. Using these")
 				plain = plain.replace("3. And he has","c. And he has")
 				plain = plain.replace("&#x200B; &#x200B;","")
-				plain = re.sub(r' [0-9]+\. ',' ',plain)
+				plain = LIST_NUMBER_RE.sub(' ',plain)
 			elif "_ring" in doc:
 				plain = plain.replace("&gt;",">")
 			elif "_escape" in doc:
@@ -345,11 +399,14 @@ def get_no_space_strings(cache_dict):
 				plain = plain.replace("enjoy working out.","enjoy working out").replace("~~","")
 			elif "_social" in doc:
 				plain = plain.replace("the purpose","those purpose").replace("&#x200B;","")
-			no_space = re.sub(r"\s","",plain).replace("*","")
-			no_space = re.sub(r'\[([^]]+)\]\([^)]+\)',r'\1',no_space)  # Remove Wiki style links: [text](URL)
-			if no_space_docs[doc] == "":
-				no_space_docs[doc] += re.sub(r"\s","",title).replace("*","")
-			no_space_docs[doc] += no_space
+			no_space = remove_whitespace(plain).replace("*","")
+			no_space = WIKI_LINK_RE.sub(r'\1',no_space)  # Remove Wiki style links: [text](URL)
+			if length == 0:
+				chunks.append(remove_whitespace(title).replace("*",""))
+				length += len(chunks[-1])
+			chunks.append(no_space)
+			length += len(no_space)
+		no_space_docs[doc] = "".join(chunks)
 
 	return no_space_docs
 
@@ -372,16 +429,172 @@ def harvest_text(files):
 		except:
 			text = io.open(file_,encoding="Latin1").read()  # e.g. wsj_0142
 		text = text.replace(".START","")  # Remove PDTB .START codes
-		text = re.sub(r'\s','', text)  # Remove all whitespace
+		text = remove_whitespace(text)
 		docs[docname] = text
 
 	return docs
 
 
-def get_proxy_data():
-	import requests
+HARVEST_MAGIC = b"DISRPTHV"
+
+
+class HarvestedText(Mapping):
+	"""
+	Read-only dictionary of document names to non-whitespace text, backed by a memory-mapped harvest cache file.
+	Documents are decoded from the file only when they are accessed.
+
+	:ivar sources: dictionary of LDC file names to the size, modification time and SHA1 hash of the file when the cache
+	               was written (see gold_cache.source_stamp)
+	"""
+
+	def __init__(self, path):
+		self.path = path
+		with io.open(path, "rb") as f:
+			if f.read(len(HARVEST_MAGIC)) != HARVEST_MAGIC:
+				raise IOError("! Not a harvest cache file: " + path + "\n")
+			header_len = int.from_bytes(f.read(8), "little")
+			header = json.loads(f.read(header_len).decode("utf8"))
+			if "docs" not in header:
+				raise IOError("! Outdated harvest cache file: " + path + "\n")
+			self.index = header["docs"]
+			self.sources = header["sources"]
+			self.data_start = len(HARVEST_MAGIC) + 8 + header_len
+			self.data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+	def __getitem__(self, docname):
+		offset, length = self.index[docname]
+		start = self.data_start + offset
+		return self.data[start:start + length].decode("utf8")
+
+	def __contains__(self, docname):
+		return docname in self.index
+
+	def __iter__(self):
+		return iter(self.index)
+
+	def __len__(self):
+		return len(self.index)
+
+	def __reduce__(self):  # Worker processes re-open the file instead of copying its contents
+		return (HarvestedText, (self.path,))
+
+	def is_fresh(self, files):
+		"""
+		:param files: LDC files containing raw text data
+		:return: True if the cache was written from the same files with the same contents; only files whose size or
+		         modification time changed are hashed again
+		"""
+		names = [os.path.basename(file_) for file_ in files]
+		if sorted(names) != sorted(self.sources):
+			return False
+		return all(is_fresh({"source": self.sources[name]}, file_) for name, file_ in zip(names, files))
+
+	def close(self):
+		self.data.close()
+
+
+def harvest_fingerprint(files):
+	"""
+	:param files: LDC files containing raw text data
+	:return: hash of the names of the files, used to name the harvest cache of this set of files
+	"""
+	sha1 = hashlib.sha1()
+	for name in sorted(os.path.basename(file_) for file_ in files):
+		sha1.update((name + "\n").encode("utf8"))
+	return sha1.hexdigest()
+
+
+def write_harvest_cache(path, docs, sources):
+	"""
+	Write a harvested text dictionary as a single file: a JSON header with the stamps of the LDC files and an index of
+	document names to (byte offset, byte length), followed by the UTF-8 encoded texts of all documents
+
+	:param path: output path
+	:param docs: dictionary of document names to non-whitespace text, as returned by harvest_text
+	:param sources: dictionary of LDC file names to stamps from gold_cache.source_stamp, taken before harvesting
+	"""
+	index = {}
+	blobs = []
+	offset = 0
+	for docname in sorted(docs):
+		blob = docs[docname].encode("utf8")
+		index[docname] = [offset, len(blob)]
+		blobs.append(blob)
+		offset += len(blob)
+	header = json.dumps({"sources": sources, "docs": index}).encode("utf8")
+	with atomic_open(path) as f:
+		f.write(HARVEST_MAGIC)
+		f.write(len(header).to_bytes(8, "little"))
+		f.write(header)
+		for blob in blobs:
+			f.write(blob)
+
+
+def harvest_text_cached(files, cache_dir=None):
+	"""
+	Like harvest_text, but persist the result in cache_dir and reuse it on later runs as long as the contents of the
+	LDC files are unchanged. Files are only read again if their size or modification time changed, and a changed set
+	of files replaces its earlier cache.
+
+	:param files: LDC files containing raw text data
+	:param cache_dir: directory for harvest cache files; if None, no cache is used
+	:return: Dictionary-like object of document base names to string of non-whitespace characters in the document
+	"""
+	with stage("harvest"):
+		count("files", len(files))
+		if cache_dir is None:
+			return harvest_text(files)
+		if not os.path.isdir(cache_dir):
+			os.makedirs(cache_dir)
+		path = os.path.join(cache_dir, "harvest_" + harvest_fingerprint(files) + ".bin")
+		if os.path.isfile(path):
+			try:
+				cached = HarvestedText(path)
+			except IOError:
+				cached = None
+			if cached is not None and cached.is_fresh(files):
+				sys.stderr.write("o Using cached LDC text from " + path + "\n")
+				return cached
+			if cached is not None:
+				cached.close()
+		sources = {os.path.basename(file_): source_stamp(file_) for file_ in files}
+		write_harvest_cache(path, harvest_text(files), sources)
+		return HarvestedText(path)
+
+
+def fetch_proxy_text(source=GUM_PROXY_URL):
+	"""
+	:param source: URL of the reddit proxy, or path of a local file (or file:// URL) with a copy of its output
+	:return: tab-delimited proxy output, one post ID and record per line
+	"""
+	if source.startswith("http://") or source.startswith("https://"):
+		import requests
+		return requests.get(source).text
+	if source.startswith("file://"):
+		source = source[len("file://"):]
+	with io.open(source, encoding="utf8") as f:
+		return f.read()
+
+
+def get_proxy_data(source=GUM_PROXY_URL, cache_file=None, refresh=False):
+	"""
+	Get reddit post records for GUM from the proxy, or from a local cache of an earlier download
+
+	:param source: URL of the reddit proxy, or path of a local stand-in file (see fetch_proxy_text)
+	:param cache_file: file to store the downloaded proxy output in and reuse on later runs; None for no cache
+	:param refresh: if True, download again even if cache_file exists
+	:return: dictionary of post IDs to records, as used by get_no_space_strings
+	"""
+	if cache_file is not None and os.path.isfile(cache_file) and not refresh:
+		with io.open(cache_file, encoding="utf8") as f:
+			tab_delim = f.read()
+	else:
+		tab_delim = fetch_proxy_text(source)
+		if cache_file is not None:
+			with io.open(cache_file + ".tmp", 'w', encoding="utf8", newline="\n") as f:
+				f.write(tab_delim)
+			os.replace(cache_file + ".tmp", cache_file)
 	out_posts = {}
-	tab_delim = requests.get("https://corpling.uis.georgetown.edu/gum/fetch_text_proxy.py").text
 	for line in tab_delim.split("\n"):
 		if "\t" in line:
 			post, text = line.split("\t")
@@ -389,257 +602,552 @@ def get_proxy_data():
 	return out_posts
 
 
-def restore_docs(path_to_underscores,text_dict):
-	def restore_range(range_string, underscored, tid_dict):
-		output = []
-		tok_ids = []
-		range_strings = range_string.split(",")
-		for r in range_strings:
-			if "-" in r:
-				s, e = r.split("-")
-				tok_ids += list(range(int(s),int(e)+1))
-			else:
-				tok_ids.append(int(r))
-
-		for tok in underscored.split():
-			if tok == "<*>":
-				output.append(tok)
-			else:
-				tid = tok_ids.pop(0)
-				output.append(tid_dict[tid])
-		return " ".join(output)
+def iter_range(range_string):
+	for r in range_string.split(","):
+		if "-" in r:
+			s, e = r.split("-")
+			for tid in range(int(s),int(e)+1):
+				yield tid
+		else:
+			yield int(r)
 
-	dep_files = glob(path_to_underscores+os.sep+"*.conllu")
-	tok_files = glob(path_to_underscores+os.sep+"*.tok")
-	rel_files = glob(path_to_underscores+os.sep+"*.rels")
-	skiplen = 0
-	token_dict = {}
-	tid2string = defaultdict(dict)
-	for file_ in dep_files + tok_files + rel_files:
-		lines = io.open(file_,encoding="utf8").readlines()
-		underscore_len = 0  # Must match doc_len at end of file processing
-		doc_len = 0
-		if file_.endswith(".rels"):
-			output = []
-			violation_rows = []
-			for l, line in enumerate(lines):
-				line = line.strip()
-				if l > 0 and "\t" in line:
-					fields = line.split("\t")
-					docname = fields[0]
-					text = text_dict[docname]
-					if "GUM_" in docname and "reddit" not in docname:  # Only Reddit documents need reconstruction in GUM
-						output.append(line)
-						continue
-					doc, unit1_toks, unit2_toks, unit1_txt, unit2_txt, s1_toks, s2_toks, unit1_sent, unit2_sent, direction, orig_label, label = line.split("\t")
-					underscore_len += unit1_txt.count("_") + unit2_txt.count("_") + unit1_sent.count("_") + unit2_sent.count("_")
-					if underscore_len == 0:
-						sys.stderr.write("! Non-underscored file detected - " + os.path.basename(file_) + "\n")
-						sys.exit(0)
-					unit1_txt = restore_range(unit1_toks, unit1_txt, tid2string[docname])
-					unit2_txt = restore_range(unit2_toks, unit2_txt, tid2string[docname])
-					unit1_sent = restore_range(s1_toks, unit1_sent, tid2string[docname])
-					unit2_sent = restore_range(s2_toks, unit2_sent, tid2string[docname])
-					plain = unit1_txt + unit2_txt + unit1_sent + unit2_sent
-					plain = plain.replace("<*>","").replace(" ","")
-					doc_len += len(plain)
-					fields = doc, unit1_toks, unit2_toks, unit1_txt, unit2_txt, s1_toks, s2_toks, unit1_sent, unit2_sent, direction, orig_label, label
-					line = "\t".join(fields)
-					if doc_len != underscore_len and len(violation_rows) == 0:
-						violation_rows.append(str(l) + ": " + line)
-				output.append(line)
 
+def restore_range(range_string, underscored, doc_tokens):
+	output = []
+	tok_ids = iter_range(range_string)
+	for tok in underscored.split():
+		if tok == "<*>":
+			output.append(tok)
 		else:
-			tokfile = True if ".tok" in file_ else False
-			output = []
-			parse_text = ""
-			docname = ""
-			for line in lines:
-				line = line.strip()
-				if "# newdoc id " in line:
-					tid = 0
-					if parse_text !="":
-						if not tokfile:
-							token_dict[docname] = parse_text
-					parse_text = ""
-					docname = re.search(r'# newdoc id ?= ?([^\s]+)',line).group(1)
-					if "GUM" in docname and "reddit" not in docname:
-						output.append(line)
-						continue
-					if docname not in text_dict:
-						raise IOError("! Text for document name " + docname + " not found.\n Please check that your LDC data contains the file for this document.\n")
-					if ".tok" in file_:
-						text = token_dict[docname]
-					else:
-						text = text_dict[docname]
-					doc_len = len(text)
-					underscore_len = 0
+			output.append(doc_tokens[next(tok_ids)])
+	return " ".join(output)
 
-				if "GUM" in docname and "reddit" not in docname:
+
+def restore_file(file_, text_dict, token_dict, tid2string):
+	"""
+	Restore text in one underscored file in place.
+
+	.conllu files must be restored before the .tok and .rels files of the same corpus, since .tok files take their
+	text from token_dict and .rels files take their token strings from tid2string.
+
+	:param file_: .conllu, .tok or .rels file to restore
+	:param text_dict: dictionary of document names to strings of non-whitespace characters in each document
+	:param token_dict: dictionary of document names to restored token text, as produced by .conllu files
+	:param tid2string: dictionary of document names to lists of token strings indexed by token ID (index 0 unused)
+	:return: tuple of (token_dict, tid2string) with the entries for documents in this file
+	"""
+	with stage("read"):
+		lines = io.open(file_,encoding="utf8").readlines()
+		count("lines", len(lines))
+	skiplen = 0
+	new_token_dict = {}
+	new_tid2string = {}
+	tokfile = True
+	parse_text = []
+	docname = ""
+	underscore_len = 0  # Must match doc_len at end of file processing
+	doc_len = 0
+	if file_.endswith(".rels"):
+		output = []
+		violation_rows = []
+		last_doc = None
+		for l, line in enumerate(lines):
+			line = line.strip()
+			if l > 0 and "\t" in line:
+				docname = line.split("\t", 1)[0]  # Split off the document name first, rows passed through need no full split
+				if "GUM_" in docname and "reddit" not in docname:  # Only Reddit documents need reconstruction in GUM
 					output.append(line)
 					continue
+				if docname != last_doc:  # Check for source text once per contiguous run of rows, without decoding it
+					if docname not in text_dict:
+						raise KeyError(docname)
+					last_doc = docname
+				doc, unit1_toks, unit2_toks, unit1_txt, unit2_txt, s1_toks, s2_toks, unit1_sent, unit2_sent, direction, orig_label, label = line.split("\t")
+				underscore_len += unit1_txt.count("_") + unit2_txt.count("_") + unit1_sent.count("_") + unit2_sent.count("_")
+				if underscore_len == 0:
+					sys.stderr.write("! Non-underscored file detected - " + os.path.basename(file_) + "\n")
+					sys.exit(0)
+				doc_tokens = tid2string.get(docname, [None])
+				unit1_txt = restore_range(unit1_toks, unit1_txt, doc_tokens)
+				unit2_txt = restore_range(unit2_toks, unit2_txt, doc_tokens)
+				unit1_sent = restore_range(s1_toks, unit1_sent, doc_tokens)
+				unit2_sent = restore_range(s2_toks, unit2_sent, doc_tokens)
+				plain = unit1_txt + unit2_txt + unit1_sent + unit2_sent
+				plain = plain.replace("<*>","").replace(" ","")
+				doc_len += len(plain)
+				fields = doc, unit1_toks, unit2_toks, unit1_txt, unit2_txt, s1_toks, s2_toks, unit1_sent, unit2_sent, direction, orig_label, label
+				line = "\t".join(fields)
+				if doc_len != underscore_len and len(violation_rows) == 0:
+					violation_rows.append(str(l) + ": " + line)
+			output.append(line)
 
-				if line.startswith("# text"):
-					m = re.match(r'(# ?text ?= ?)(.+)',line)
-					if m is not None:
-						i = 0
-						sent_text = ""
-						for char in m.group(2).strip():
-							if char != " ":
-								sent_text += text[i]
-								i+=1
-							else:
-								sent_text += " "
-						line = m.group(1) + sent_text
-						output.append(line)
-				elif "\t" in line:
-					fields = line.split("\t")
-					if skiplen < 1:
-						underscore_len += len(fields[1])
-						fields[1] = text[:len(fields[1])]
-					if not "-" in fields[0] and not "." in fields[0]:
-						parse_text += fields[1]
-						tid += 1
-						tid2string[docname][tid] = fields[1]
+	else:
+		tokfile = True if ".tok" in file_ else False
+		output = []
+		parse_text = []  # Restored token strings of the current document, joined when the document ends
+		docname = ""
+		pos = 0  # Cursor into the source text of the current document
+		for line in lines:
+			line = line.strip()
+			m = NEWDOC_RE.search(line) if "# newdoc id " in line else None  # Malformed newdoc lines are kept as comments
+			if m is not None:
+				if len(parse_text) > 0:
 					if not tokfile:
-						if fields[2] == '_' and not "-" in fields[0] and not "." in fields[0]:
-							fields[2] = fields[1]
-						elif fields[2] == "*LOWER*":
-							fields[2] = fields[1].lower()
-					if skiplen < 1:
-						text = text[len(fields[1]):]
-					else:
-						skiplen -=1
-					output.append("\t".join(fields))
-					if "-" in fields[0]:  # Multitoken
-						start, end = fields[0].split("-")
-						start = int(start)
-						end = int(end)
-						skiplen = end - start + 1
-				else:
+						new_token_dict[docname] = "".join(parse_text)
+				parse_text = []
+				docname = m.group(1)
+				new_tid2string[docname] = [None]
+				if "GUM" in docname and "reddit" not in docname:
 					output.append(line)
+					continue
+				if docname not in text_dict:
+					raise IOError("! Text for document name " + docname + " not found.\n Please check that your LDC data contains the file for this document.\n")
+				if ".tok" in file_:
+					text = token_dict[docname]
+				else:
+					text = text_dict[docname]
+				doc_len = len(text)
+				underscore_len = 0
+				pos = 0
+
+			if "GUM" in docname and "reddit" not in docname:
+				output.append(line)
+				continue
 
-		if not doc_len == underscore_len:
-			if ".rels" in file_:
-				sys.stderr.write(
-					"\n! Tried to restore file " + os.path.basename(file_) + " but source text has different length than tokens in shared task file:\n" + \
-					"  Source text in data/: " + str(doc_len) + " non-whitespace characters\n" + \
-					"  Token underscores in " + file_ + ": " + str(underscore_len) + " non-whitespace characters\n" + \
-					"  Violation row: " + violation_rows[0])
+			if line.startswith("# text"):
+				m = TEXT_RE.match(line)
+				if m is not None:
+					# Fill each space-delimited chunk from the text at the cursor, without consuming it
+					i = pos
+					sent_text = []
+					for chunk in m.group(2).strip().split(" "):
+						sent_text.append(text[i:i+len(chunk)])
+						i += len(chunk)
+					line = m.group(1) + " ".join(sent_text)
+					output.append(line)
+			elif "\t" in line:
+				fields = line.split("\t")
+				if skiplen < 1:
+					underscore_len += len(fields[1])
+					fields[1] = text[pos:pos+len(fields[1])]
+				if not "-" in fields[0] and not "." in fields[0]:
+					parse_text.append(fields[1])
+					new_tid2string[docname].append(fields[1])
+				if not tokfile:
+					if fields[2] == '_' and not "-" in fields[0] and not "." in fields[0]:
+						fields[2] = fields[1]
+					elif fields[2] == "*LOWER*":
+						fields[2] = fields[1].lower()
+				if skiplen < 1:
+					pos += len(fields[1])
+				else:
+					skiplen -=1
+				output.append("\t".join(fields))
+				if "-" in fields[0]:  # Multitoken
+					start, end = fields[0].split("-")
+					start = int(start)
+					end = int(end)
+					skiplen = end - start + 1
 			else:
-				sys.stderr.write("\n! Tried to restore document " + docname + " but source text has different length than tokens in shared task file:\n" + \
-						  "  Source text in data/: " + str(doc_len) + " non-whitespace characters\n" + \
-						  "  Token underscores in " + file_+": " + str(underscore_len) + " non-whitespace characters\n")
-			with io.open("debug.txt",'w',encoding="utf8") as f:
-				f.write(text_dict[docname])
-				f.write("\n\n\n")
-				f.write(parse_text)
-			sys.exit(0)
+				output.append(line)
+
+	if not doc_len == underscore_len:
+		if ".rels" in file_:
+			sys.stderr.write(
+				"\n! Tried to restore file " + os.path.basename(file_) + " but source text has different length than tokens in shared task file:\n" + \
+				"  Source text in data/: " + str(doc_len) + " non-whitespace characters\n" + \
+				"  Token underscores in " + file_ + ": " + str(underscore_len) + " non-whitespace characters\n" + \
+				"  Violation row: " + violation_rows[0])
+		else:
+			sys.stderr.write("\n! Tried to restore document " + docname + " but source text has different length than tokens in shared task file:\n" + \
+					  "  Source text in data/: " + str(doc_len) + " non-whitespace characters\n" + \
+					  "  Token underscores in " + file_+": " + str(underscore_len) + " non-whitespace characters\n")
+		with io.open("debug.txt",'w',encoding="utf8") as f:
+			f.write(text_dict[docname])
+			f.write("\n\n\n")
+			f.write("".join(parse_text))
+		sys.exit(0)
 
-		if not tokfile and parse_text != "":
-			token_dict[docname] = parse_text
+	if not tokfile and len(parse_text) > 0:
+		new_token_dict[docname] = "".join(parse_text)
 
+	with stage("write"):
 		with io.open(file_, 'w', encoding='utf8', newline="\n") as fout:
 			fout.write("\n".join(output) + "\n")
+		count("lines", len(output))
+
+	return new_token_dict, new_tid2string
+
+
+def list_corpus_files(path_to_underscores):
+	dep_files = glob(path_to_underscores+os.sep+"*.conllu")
+	tok_files = glob(path_to_underscores+os.sep+"*.tok")
+	rel_files = glob(path_to_underscores+os.sep+"*.rels")
+	return dep_files, tok_files, rel_files
 
-	sys.stderr.write("o Restored text in " + str(len(dep_files)) + " .conllu files, " + str(len(tok_files)) +
+
+def report_restored(dep_files, tok_files, rel_files, corpus=""):
+	prefix = "o " + corpus + ": restored" if corpus != "" else "o Restored"
+	sys.stderr.write(prefix + " text in " + str(len(dep_files)) + " .conllu files, " + str(len(tok_files)) +
 					 " .tok files and "+ str(len(rel_files)) + " .rels files\n")
 
 
-p = ArgumentParser()
-p.add_argument("corpus",action="store",choices=["rstdt","pdtb","cdtb","tdb","gum","all"],default="all",help="Name of the corpus to process or 'all'")
-p.add_argument("-m","--mode",action="store",choices=["add","del"],default="add",help="Use 'add' to restore data and 'del' to replace text with underscores")
-opts = p.parse_args()
-
-# DEL MODE - MAKE UNDERSCORES
-if opts.mode == "del":  # Remove text from resources that need to be underscored for distribution
-	files = []
-	if opts.corpus == "rstdt" or opts.corpus == "all":
-		corpus_files = glob(os.sep.join(["..","data","eng.rst.rstdt","*.conllu"])) + \
-					   glob(os.sep.join(["..","data","eng.rst.rstdt","*.tok"])) + \
-					   glob(os.sep.join(["..", "data", "eng.rst.rstdt", "*.rels"]))
-		sys.stderr.write("o Found " + str(len(corpus_files)) + " files in " + os.sep.join(["..","data","eng.rst.rstdt"]) + "\n")
-		files += corpus_files
-	if opts.corpus == "pdtb" or opts.corpus == "all":
-		corpus_files = glob(os.sep.join(["..","data","eng.pdtb.pdtb","*.conllu"])) + \
-					   glob(os.sep.join(["..","data","eng.pdtb.pdtb","*.tok"])) + \
-					   glob(os.sep.join(["..", "data", "eng.pdtb.pdtb", "*.rels"]))
-		sys.stderr.write("o Found " + str(len(corpus_files)) + " files in " + os.sep.join(["..","data","eng.pdtb.pdtb"]) + "\n")
-		files += corpus_files
-	if opts.corpus == "cdtb" or opts.corpus == "all":
-		corpus_files = glob(os.sep.join(["..","data","zho.pdtb.cdtb","*.conllu"])) + \
-					   glob(os.sep.join(["..","data","zho.pdtb.cdtb","*.tok"])) + \
-					   glob(os.sep.join(["..","data","zho.pdtb.cdtb","*.rels"]))
-		sys.stderr.write("o Found " + str(len(corpus_files)) + " files in " + os.sep.join(["..","data","zho.pdtb.cdtb"]) + "\n")
-		files += corpus_files
-	if opts.corpus == "tdb" or opts.corpus == "all":
-		corpus_files = glob(os.sep.join(["..","data","tur.pdtb.tdb","*.conllu"])) + \
-					   glob(os.sep.join(["..","data","tur.pdtb.tdb","*.tok"])) + \
-					   glob(os.sep.join(["..","data","tur.pdtb.tdb","*.rels"]))
-		sys.stderr.write("o Found " + str(len(corpus_files)) + " files in " + os.sep.join(["..","data","tur.pdtb.tdb"]) + "\n")
-		files += corpus_files
-	if opts.corpus == "gum" or opts.corpus == "all":
-		corpus_files = glob(os.sep.join(["..","data","eng.rst.gum","*.conllu"])) + \
-					   glob(os.sep.join(["..","data","eng.rst.gum","*.tok"])) + \
-					   glob(os.sep.join(["..","data","eng.rst.gum","*.rels"]))
-		sys.stderr.write("o Found " + str(len(corpus_files)) + " files in " + os.sep.join(["..","data","eng.rst.gum"]) + "\n")
-		files += corpus_files
-	underscore_files(files)
-	sys.stderr.write("o Replaced text with underscores in " + str(len(files)) + " files\n")
-	sys.exit(1)
-
-
-# ADD MODE - RESTORE TEXT
-
-# Prompt user for corpus folders
-if opts.corpus == "rstdt" or opts.corpus == "all":
-	rstdt_path = input("Enter path for LDC RST-DT data/ folder:\n> ")
-	if not os.path.isdir(rstdt_path):
-		sys.stderr.write("Can't find directory at: " + rstdt_path + "\n")
-		sys.exit(0)
-	files = glob(os.sep.join([rstdt_path,"RSTtrees-WSJ-main-1.0","TRAINING","*.edus"])) + glob(os.sep.join([rstdt_path,"RSTtrees-WSJ-main-1.0","TEST","*.edus"]))
-	docs2text = harvest_text(files)
-	restore_docs(os.sep.join(["..","data","eng.rst.rstdt"]),docs2text)
-if opts.corpus == "pdtb" or opts.corpus == "all":
-	pdtb_path = input("Enter path for LDC Treebank 2 raw/wsj/ folder:\n> ")
-	if not os.path.isdir(pdtb_path):
-		sys.stderr.write("Can't find directory at: " + pdtb_path + "\n")
-		sys.exit(0)
-	files = []
-	for i in range(0,25):
-		dir_name = str(i) if i > 9 else "0" + str(i)
-		files += glob(os.sep.join([pdtb_path,dir_name,"wsj_*"]))
-	docs2text = harvest_text(files)
-	restore_docs(os.sep.join(["..","data","eng.pdtb.pdtb"]),docs2text)
-if opts.corpus == "cdtb" or opts.corpus == "all":
-	cdtb_path = input("Enter path for LDC Chinese Discourse Treebank 0.5 raw/ folder:\n> ")
-	if not os.path.isdir(cdtb_path):
-		sys.stderr.write("Can't find directory at: " + cdtb_path + "\n")
-		sys.exit(0)
-	files = glob(os.sep.join([cdtb_path,"*.raw"]))
-	docs2text = harvest_text(files)
-	restore_docs(os.sep.join(["..","data","zho.pdtb.cdtb"]),docs2text)
-if opts.corpus == "tdb" or opts.corpus == "all":
-	tdb_path = input("Enter path for Turkish Discourse Bank 1.0 raw/01/ folder:\n> ")
-	if not os.path.isdir(tdb_path):
-		sys.stderr.write("Can't find directory at: " + tdb_path + "\n")
-		sys.exit(0)
-	files = glob(os.sep.join([tdb_path,"*.txt"]))
-	docs2text = harvest_text(files)
-	restore_docs(os.sep.join(["..","data","tur.pdtb.tdb"]),docs2text)
-
-if opts.corpus == "gum" or opts.corpus == "all":
-	response = input("Do you want to try downloading reddit data from an available server?\n"+
-					 "Confirm: you are solely responsible for downloading reddit data and "+
-					 "may only use it for non-commercial purposes:\n[Y]es/[N]o> ")
-	if response == "Y":
-		print("Retrieving reddit data by proxy...")
-		data = get_proxy_data()
-		docs2text = get_no_space_strings(data)
-	else:
-		sys.stderr.write("Aborting\n")
-		sys.exit(0)
-	restore_docs(os.sep.join(["..","data","eng.rst.gum"]),docs2text)
+def restore_docs(path_to_underscores,text_dict):
+	dep_files, tok_files, rel_files = list_corpus_files(path_to_underscores)
+	token_dict = {}
+	tid2string = {}
+	for file_ in dep_files + tok_files + rel_files:
+		with stage("restore"):
+			new_token_dict, new_tid2string = restore_file(file_, text_dict, token_dict, tid2string)
+		token_dict.update(new_token_dict)
+		tid2string.update(new_tid2string)
+
+	report_restored(dep_files, tok_files, rel_files)
 
 
+def restore_parallel(corpora, jobs=None):
+	"""
+	Restore several corpora concurrently in worker processes. Files of each corpus are scheduled by dependency:
+	all .conllu files of a corpus are restored first (in parallel), after which its .tok and .rels files are
+	restored in parallel using the token strings collected from the .conllu files.
+
+	:param corpora: list of (path_to_underscores, text_dict) tuples, as passed to restore_docs
+	:param jobs: number of worker processes, or None to use all cores
+	"""
+	state = {}
+	pending = {}
+	with ProcessPoolExecutor(max_workers=jobs) as executor:
+		def submit_dependents(path):
+			corpus = state[path]
+			for file_ in corpus["tok_files"] + corpus["rel_files"]:
+				future = executor.submit(restore_file, file_, corpus["text_dict"], corpus["token_dict"], corpus["tid2string"])
+				pending[future] = (path, False)
+
+		for path, text_dict in corpora:
+			dep_files, tok_files, rel_files = list_corpus_files(path)
+			state[path] = {"text_dict": text_dict, "dep_files": dep_files, "tok_files": tok_files, "rel_files": rel_files,
+						   "waiting": len(dep_files) + len(tok_files) + len(rel_files), "deps_left": len(dep_files),
+						   "token_dict": {}, "tid2string": {}}
+			for file_ in dep_files:
+				future = executor.submit(restore_file, file_, text_dict, {}, {})
+				pending[future] = (path, True)
+			if len(dep_files) == 0:
+				submit_dependents(path)
+
+		while len(pending) > 0:
+			done, _ = wait(pending, return_when=FIRST_COMPLETED)
+			for future in done:
+				path, is_dep = pending.pop(future)
+				new_token_dict, new_tid2string = future.result()
+				corpus = state[path]
+				corpus["waiting"] -= 1
+				if is_dep:
+					corpus["token_dict"].update(new_token_dict)
+					corpus["tid2string"].update(new_tid2string)
+					corpus["deps_left"] -= 1
+					if corpus["deps_left"] == 0:
+						submit_dependents(path)
+				if corpus["waiting"] == 0:
+					report_restored(corpus["dep_files"], corpus["tok_files"], corpus["rel_files"], os.path.basename(os.path.normpath(path)))
+
+
+MANIFEST_NAME = ".restore_manifest.json"
+STORE_NAME = ".restore_store"
+
+
+def doc_hash(lines):
+	return hashlib.sha1("\n".join(lines).encode("utf8")).hexdigest()
+
+
+def split_docs(file_):
+	"""
+	Split a shared task file into per-document chunks of stripped lines. Lines before the first document
+	(e.g. the .rels header row) form a chunk with document name None.
 
+	:param file_: .conllu, .tok or .rels file
+	:return: list of (docname, lines) tuples in file order
+	"""
+	chunks = [(None, [])]
+	rels = file_.endswith(".rels")
+	for l, line in enumerate(io.open(file_,encoding="utf8").readlines()):
+		line = line.strip()
+		if rels:
+			if l > 0 and "\t" in line:
+				docname = line.split("\t",1)[0]
+				if docname != chunks[-1][0]:
+					chunks.append((docname, []))
+		elif "# newdoc id " in line:
+			m = NEWDOC_RE.search(line)
+			if m is not None:
+				chunks.append((m.group(1), []))
+		chunks[-1][1].append(line)
+	return chunks
+
+
+def collect_tokens(lines):
+	"""
+	:param lines: restored .conllu lines of one document
+	:return: tuple of restored token text and list of token strings indexed by token ID, as produced by restore_file
+	"""
+	tokens = [None]
+	for line in lines:
+		if "\t" in line:
+			fields = line.split("\t")
+			if not "-" in fields[0] and not "." in fields[0]:
+				tokens.append(fields[1])
+	return "".join(tokens[1:]), tokens
+
+
+def plan_incremental(path_to_underscores):
+	"""
+	Compare every document in a corpus directory to the restoration manifest. Documents whose content matches their
+	restored hash are kept, documents matching their underscored hash are re-filled from the local store of restored
+	documents, and all other documents (new or changed) need to be restored from source text.
+
+	The manifest has one entry per contiguous run of a document's lines, since rows of one document in a .rels file
+	need not be contiguous (e.g. eng.sdrt.stac); runs are numbered in file order.
+
+	:param path_to_underscores: corpus directory
+	:return: tuple of manifest dictionary and dictionary of file path -> list of [docname, lines, status, run]
+	"""
+	manifest_path = os.path.join(path_to_underscores, MANIFEST_NAME)
+	store = os.path.join(path_to_underscores, STORE_NAME)
+	manifest = json.load(io.open(manifest_path,encoding="utf8")) if os.path.isfile(manifest_path) else {}
+	plan = {}
+	for file_ in sum(list_corpus_files(path_to_underscores), []):
+		entries = manifest.get(os.path.basename(file_), {})
+		runs = defaultdict(int)
+		plan[file_] = []
+		for docname, lines in split_docs(file_):
+			run = runs[docname]
+			runs[docname] += 1
+			doc_entries = entries.get(docname, [])
+			if not isinstance(doc_entries, list):  # Manifest written before runs were recorded
+				doc_entries = [doc_entries]
+			entry = doc_entries[run] if run < len(doc_entries) else None
+			if docname is None:
+				status = "keep"
+			elif entry is not None and doc_hash(lines) == entry["restored"]:
+				status = "keep"
+			elif entry is not None and doc_hash(lines) == entry["underscored"] and os.path.isfile(os.path.join(store, entry["restored"])):
+				status = "reuse"
+			else:
+				status = "todo"
+			plan[file_].append([docname, lines, status, run])
+	return manifest, plan
+
+
+def needs_restore(path_to_underscores):
+	"""
+	:return: True if any document in the corpus directory is not restored according to the manifest
+	"""
+	_, plan = plan_incremental(path_to_underscores)
+	return any(chunk[2] != "keep" for chunks in plan.values() for chunk in chunks)
+
+
+def restore_incremental(path_to_underscores, text_dict):
+	"""
+	Restore only new or changed documents in a corpus directory, using a per-document manifest of underscored and
+	restored content hashes (.restore_manifest.json) and a store of restored documents (.restore_store/).
+	Unchanged documents are kept or re-filled from the store without using text_dict.
+
+	:param path_to_underscores: corpus directory
+	:param text_dict: dictionary of document names to strings of non-whitespace characters in each document
+	"""
+	manifest, plan = plan_incremental(path_to_underscores)
+	store = os.path.join(path_to_underscores, STORE_NAME)
+	if not os.path.isdir(store):
+		os.makedirs(store)
+	token_dict = {}
+	tid2string = {}
+	restored_docs = 0
+	tmp_dir = tempfile.mkdtemp()
+	try:
+		for file_ in sum(list_corpus_files(path_to_underscores), []):
+			chunks = plan[file_]
+			entries = manifest.setdefault(os.path.basename(file_), {})
+			for docname in list(entries):
+				if not isinstance(entries[docname], list):  # Manifest written before runs were recorded
+					entries[docname] = [entries[docname]]
+			for chunk in chunks:
+				if chunk[2] == "reuse":
+					with io.open(os.path.join(store, entries[chunk[0]][chunk[3]]["restored"]),encoding="utf8") as f:
+						chunk[1] = f.read().split("\n")
+
+			todo = [chunk for chunk in chunks if chunk[2] == "todo"]
+			if len(todo) > 0:
+				# Restore a copy of the file containing only the documents that need restoration
+				tmp_file = os.path.join(tmp_dir, os.path.basename(file_))
+				with io.open(tmp_file, 'w', encoding='utf8', newline="\n") as f:
+					f.write("\n".join(line for chunk in chunks if chunk[0] is None or chunk[2] == "todo" for line in chunk[1]) + "\n")
+				with stage("restore"):
+					new_token_dict, new_tid2string = restore_file(tmp_file, text_dict, token_dict, tid2string)
+				token_dict.update(new_token_dict)
+				tid2string.update(new_tid2string)
+				if file_.endswith(".rels"):
+					# Rows are restored one to one, but runs of a document can be adjacent in tmp_file, so cut the
+					# restored rows by the lengths of the runs instead of splitting tmp_file by document again
+					with io.open(tmp_file,encoding="utf8") as f:
+						rows = [line.strip() for line in f]
+					offset = len(chunks[0][1]) if chunks[0][0] is None else 0
+					restored = []
+					for chunk in todo:
+						restored.append((chunk[0], rows[offset:offset + len(chunk[1])]))
+						offset += len(chunk[1])
+				else:
+					restored = [chunk for chunk in split_docs(tmp_file) if chunk[0] is not None]
+				for chunk, (docname, lines) in zip(todo, restored):
+					doc_entries = entries.setdefault(docname, [])
+					doc_entries.extend([None] * (chunk[3] + 1 - len(doc_entries)))
+					doc_entries[chunk[3]] = {"underscored": doc_hash(chunk[1]), "restored": doc_hash(lines)}
+					with io.open(os.path.join(store, doc_entries[chunk[3]]["restored"]), 'w', encoding='utf8', newline="\n") as f:
+						f.write("\n".join(lines))
+					chunk[1] = lines
+				restored_docs += len(todo)
+
+			if file_.endswith(".conllu"):  # Token strings of unchanged documents for dependent .tok and .rels files
+				for docname, lines, status, run in chunks:
+					if docname is not None and status != "todo":
+						token_dict[docname], tid2string[docname] = collect_tokens(lines)
+
+			if any(chunk[2] != "keep" for chunk in chunks):
+				with io.open(file_, 'w', encoding='utf8', newline="\n") as fout:
+					fout.write("\n".join(line for chunk in chunks for line in chunk[1]) + "\n")
+	finally:
+		shutil.rmtree(tmp_dir)
+
+	with io.open(os.path.join(path_to_underscores, MANIFEST_NAME), 'w', encoding='utf8', newline="\n") as f:
+		f.write(json.dumps(manifest, indent=1, sort_keys=True) + "\n")
+	sys.stderr.write("o " + os.path.basename(os.path.normpath(path_to_underscores)) + ": restored " + str(restored_docs) +
+					 " new or changed documents\n")
+
+
+if __name__ == "__main__":
+	p = ArgumentParser()
+	p.add_argument("corpus",action="store",choices=["rstdt","pdtb","cdtb","tdb","gum","all"],default="all",help="Name of the corpus to process or 'all'")
+	p.add_argument("-m","--mode",action="store",choices=["add","del"],default="add",help="Use 'add' to restore data and 'del' to replace text with underscores")
+	p.add_argument("-c","--cache_dir",action="store",default=None,help="Directory to cache harvested LDC text in for faster reruns")
+	p.add_argument("-i","--incremental",action="store_true",help="Only restore new or changed documents, using a manifest kept in each corpus directory")
+	p.add_argument("-j","--jobs",action="store",type=int,default=1,help="Number of worker processes for restoring corpora or underscoring files in parallel (0 = all cores)")
+	p.add_argument("--proxy",action="store",default=GUM_PROXY_URL,help="URL of the reddit proxy for GUM, or a local file with a copy of its output")
+	p.add_argument("--proxy_cache",action="store",default=None,help="File to cache downloaded reddit data in (default: " + PROXY_CACHE_NAME + " in the cache directory or data/eng.rst.gum/)")
+	p.add_argument("--refresh_proxy",action="store_true",help="Download reddit data again even if a cached copy exists")
+	add_profile_args(p)
+	opts = p.parse_args()
+	enable_profile("process_underscores", opts.profile, opts.profile_stage)
+
+	# DEL MODE - MAKE UNDERSCORES
+	if opts.mode == "del":  # Remove text from resources that need to be underscored for distribution
+		files = []
+		if opts.corpus == "rstdt" or opts.corpus == "all":
+			corpus_files = glob(os.sep.join(["..","data","eng.rst.rstdt","*.conllu"])) + \
+						   glob(os.sep.join(["..","data","eng.rst.rstdt","*.tok"])) + \
+						   glob(os.sep.join(["..", "data", "eng.rst.rstdt", "*.rels"]))
+			sys.stderr.write("o Found " + str(len(corpus_files)) + " files in " + os.sep.join(["..","data","eng.rst.rstdt"]) + "\n")
+			files += corpus_files
+		if opts.corpus == "pdtb" or opts.corpus == "all":
+			corpus_files = glob(os.sep.join(["..","data","eng.pdtb.pdtb","*.conllu"])) + \
+						   glob(os.sep.join(["..","data","eng.pdtb.pdtb","*.tok"])) + \
+						   glob(os.sep.join(["..", "data", "eng.pdtb.pdtb", "*.rels"]))
+			sys.stderr.write("o Found " + str(len(corpus_files)) + " files in " + os.sep.join(["..","data","eng.pdtb.pdtb"]) + "\n")
+			files += corpus_files
+		if opts.corpus == "cdtb" or opts.corpus == "all":
+			corpus_files = glob(os.sep.join(["..","data","zho.pdtb.cdtb","*.conllu"])) + \
+						   glob(os.sep.join(["..","data","zho.pdtb.cdtb","*.tok"])) + \
+						   glob(os.sep.join(["..","data","zho.pdtb.cdtb","*.rels"]))
+			sys.stderr.write("o Found " + str(len(corpus_files)) + " files in " + os.sep.join(["..","data","zho.pdtb.cdtb"]) + "\n")
+			files += corpus_files
+		if opts.corpus == "tdb" or opts.corpus == "all":
+			corpus_files = glob(os.sep.join(["..","data","tur.pdtb.tdb","*.conllu"])) + \
+						   glob(os.sep.join(["..","data","tur.pdtb.tdb","*.tok"])) + \
+						   glob(os.sep.join(["..","data","tur.pdtb.tdb","*.rels"]))
+			sys.stderr.write("o Found " + str(len(corpus_files)) + " files in " + os.sep.join(["..","data","tur.pdtb.tdb"]) + "\n")
+			files += corpus_files
+		if opts.corpus == "gum" or opts.corpus == "all":
+			corpus_files = glob(os.sep.join(["..","data","eng.rst.gum","*.conllu"])) + \
+						   glob(os.sep.join(["..","data","eng.rst.gum","*.tok"])) + \
+						   glob(os.sep.join(["..","data","eng.rst.gum","*.rels"]))
+			sys.stderr.write("o Found " + str(len(corpus_files)) + " files in " + os.sep.join(["..","data","eng.rst.gum"]) + "\n")
+			files += corpus_files
+		underscore_files(files, opts.jobs if opts.jobs > 0 else None)
+		sys.stderr.write("o Replaced text with underscores in " + str(len(files)) + " files\n")
+		sys.exit(1)
+
+
+	# ADD MODE - RESTORE TEXT
+
+	def selected(corpus, corpus_dir):
+		if opts.corpus != corpus and opts.corpus != "all":
+			return False
+		if opts.incremental and not needs_restore(corpus_dir):
+			sys.stderr.write("o No new or changed documents in " + corpus_dir + "\n")
+			return False
+		return True
+
+	# Prompt user for corpus folders
+	corpora = []
+	if selected("rstdt", os.sep.join(["..","data","eng.rst.rstdt"])):
+		rstdt_path = input("Enter path for LDC RST-DT data/ folder:\n> ")
+		if not os.path.isdir(rstdt_path):
+			sys.stderr.write("Can't find directory at: " + rstdt_path + "\n")
+			sys.exit(0)
+		files = glob(os.sep.join([rstdt_path,"RSTtrees-WSJ-main-1.0","TRAINING","*.edus"])) + glob(os.sep.join([rstdt_path,"RSTtrees-WSJ-main-1.0","TEST","*.edus"]))
+		docs2text = harvest_text_cached(files, opts.cache_dir)
+		corpora.append((os.sep.join(["..","data","eng.rst.rstdt"]),docs2text))
+	if selected("pdtb", os.sep.join(["..","data","eng.pdtb.pdtb"])):
+		pdtb_path = input("Enter path for LDC Treebank 2 raw/wsj/ folder:\n> ")
+		if not os.path.isdir(pdtb_path):
+			sys.stderr.write("Can't find directory at: " + pdtb_path + "\n")
+			sys.exit(0)
+		files = []
+		for i in range(0,25):
+			dir_name = str(i) if i > 9 else "0" + str(i)
+			files += glob(os.sep.join([pdtb_path,dir_name,"wsj_*"]))
+		docs2text = harvest_text_cached(files, opts.cache_dir)
+		corpora.append((os.sep.join(["..","data","eng.pdtb.pdtb"]),docs2text))
+	if selected("cdtb", os.sep.join(["..","data","zho.pdtb.cdtb"])):
+		cdtb_path = input("Enter path for LDC Chinese Discourse Treebank 0.5 raw/ folder:\n> ")
+		if not os.path.isdir(cdtb_path):
+			sys.stderr.write("Can't find directory at: " + cdtb_path + "\n")
+			sys.exit(0)
+		files = glob(os.sep.join([cdtb_path,"*.raw"]))
+		docs2text = harvest_text_cached(files, opts.cache_dir)
+		corpora.append((os.sep.join(["..","data","zho.pdtb.cdtb"]),docs2text))
+	if selected("tdb", os.sep.join(["..","data","tur.pdtb.tdb"])):
+		tdb_path = input("Enter path for Turkish Discourse Bank 1.0 raw/01/ folder:\n> ")
+		if not os.path.isdir(tdb_path):
+			sys.stderr.write("Can't find directory at: " + tdb_path + "\n")
+			sys.exit(0)
+		files = glob(os.sep.join([tdb_path,"*.txt"]))
+		docs2text = harvest_text_cached(files, opts.cache_dir)
+		corpora.append((os.sep.join(["..","data","tur.pdtb.tdb"]),docs2text))
+
+	if selected("gum", os.sep.join(["..","data","eng.rst.gum"])):
+		response = input("Do you want to try downloading reddit data from an available server?\n"+
+						 "Confirm: you are solely responsible for downloading reddit data and "+
+						 "may only use it for non-commercial purposes:\n[Y]es/[N]o> ")
+		if response == "Y":
+			proxy_cache = opts.proxy_cache
+			if proxy_cache is None:
+				proxy_cache = os.path.join(opts.cache_dir if opts.cache_dir is not None else os.sep.join(["..","data","eng.rst.gum"]), PROXY_CACHE_NAME)
+			if os.path.isfile(proxy_cache) and not opts.refresh_proxy:
+				print("Using cached reddit data from " + proxy_cache + "...")
+			else:
+				print("Retrieving reddit data by proxy...")
+			with stage("fetch_proxy"):
+				data = get_proxy_data(opts.proxy, proxy_cache, opts.refresh_proxy)
+			with stage("harvest"):
+				docs2text = get_no_space_strings(data)
+		else:
+			sys.stderr.write("Aborting\n")
+			sys.exit(0)
+		corpora.append((os.sep.join(["..","data","eng.rst.gum"]),docs2text))
+
+	if opts.incremental:
+		for path, docs2text in corpora:
+			restore_incremental(path,docs2text)
+	elif opts.jobs == 1:
+		for path, docs2text in corpora:
+			restore_docs(path,docs2text)
+	else:
+		restore_parallel(corpora, jobs=opts.jobs if opts.jobs > 0 else None)
@@ -1,7 +1,11 @@
-import io
 import os
+import sys
 import argparse
-from sklearn.metrics import accuracy_score
+from collections import defaultdict
+
+from rels_table import iter_column
+from eval_errors import EvaluationError, LabelCountMismatch
+from stage_profile import stage, count, add_profile_args, enable_profile
 
 """
 Script to evaluate relation classification accuracy score from the .rels file:
@@ -16,6 +20,7 @@ Arguments:
  * predfile: same format, with predicted labels positions in column 12 (the last column) 
     - note **number of relation classification instances must match**  
  * string_input: if specified, files are replaced by strings with file contents instead of file names
+ * --profile: print stage timing and memory as JSON to stderr, or write it to a file given after the flag (see stage_profile.py)
 
 """
 
@@ -34,17 +39,86 @@ def parse_data(infile, string_input=False) -> list:
 	:return: a list of labels
 	"""
 
-	if not string_input:
-		data = io.open(infile, encoding="utf-8").read().strip().replace("\r", "")
-	else:
-		data = infile.strip()
-
-	labels = [line.split("\t")[-1] for line in data.split("\n") if "\t" in line]
+	# Only the label column is split off each line; the text columns are never materialized
+	labels = list(iter_column(infile, "label", string_input))
 
 	return labels
 
 
-def get_accuracy_score(gold_file, pred_file, string_input=False) -> dict:
+def check_counts(gold_labels, pred_labels, filename, gold_file=None, string_input=False) -> None:
+	"""
+	This function is to check that gold and pred have the same number of relation instances.
+
+	:param gold_labels: list of gold labels
+	:param pred_labels: list of predicted labels
+	:param filename: name of the gold file for reports
+	:param gold_file: Gold shared task file, used to look up the document of the first mismatch
+	:param string_input: If True, gold_file is a string with file contents
+	:raises LabelCountMismatch: if the numbers of labels differ, with a report as described in eval_errors.py
+	"""
+
+	if len(gold_labels) == len(pred_labels):
+		return
+
+	index = min(len(gold_labels), len(pred_labels))
+	doc = None
+	doc_offset = None
+	if gold_file is not None and index < len(gold_labels):
+		for i, name in enumerate(iter_column(gold_file, "doc", string_input)):
+			if name != doc:
+				doc = name
+				doc_offset = 0
+			else:
+				doc_offset += 1
+			if i == index:
+				break
+	first_mismatch = {"index": index, "doc": doc, "doc_offset": doc_offset,
+					  "gold": gold_labels[index] if index < len(gold_labels) else None,
+					  "pred": pred_labels[index] if index < len(pred_labels) else None}
+
+	report = "\nFATAL: different number of labels detected in gold and pred:\n"
+	report += "  o In " + filename + ": " + str(len(gold_labels)) + " gold instances but " + str(len(pred_labels)) + " predicted instances\n\n"
+	raise LabelCountMismatch(report, {"file": filename, "gold_count": len(gold_labels), "pred_count": len(pred_labels),
+									  "first_mismatch": first_mismatch})
+
+
+def score_labels(gold_labels, pred_labels) -> tuple:
+	"""
+	This function is to compute the accuracy, a confusion matrix and per-label scores in a single pass over the labels.
+
+	:param gold_labels: list of gold labels
+	:param pred_labels: list of predicted labels, same length as gold_labels
+	:return: tuple of accuracy, confusion matrix as a dictionary of gold label -> predicted label -> count,
+	         and dictionary of label -> dictionary of precision, recall, f-score and gold support
+	"""
+
+	correct = 0
+	confusion = defaultdict(lambda: defaultdict(int))
+	gold_counts = defaultdict(int)
+	pred_counts = defaultdict(int)
+	for gold, pred in zip(gold_labels, pred_labels):
+		confusion[gold][pred] += 1
+		gold_counts[gold] += 1
+		pred_counts[pred] += 1
+		if gold == pred:
+			correct += 1
+
+	acc = correct / len(gold_labels) if len(gold_labels) > 0 else 0.0
+
+	label_scores = {}
+	for label in sorted(set(gold_counts) | set(pred_counts)):
+		true_positive = confusion[label].get(label, 0) if label in confusion else 0
+		precision = true_positive / pred_counts[label] if pred_counts[label] > 0 else 0.0
+		recall = true_positive / gold_counts[label] if gold_counts[label] > 0 else 0.0
+		f_score = 2 * precision * recall / (precision + recall) if precision + recall > 0 else 0.0
+		label_scores[label] = {"prec": precision, "rec": recall, "f_score": f_score, "support": gold_counts[label]}
+
+	confusion = {gold: dict(preds) for gold, preds in confusion.items()}
+
+	return acc, confusion, label_scores
+
+
+def get_accuracy_score(gold_file, pred_file, string_input=False, use_cache=False) -> dict:
 	"""
 	This function is to obtain the gold and predicted labels from their respective .rels file
 	and compute the accuracy score.
@@ -52,22 +126,36 @@ def get_accuracy_score(gold_file, pred_file, string_input=False) -> dict:
 	:param gold_file: Gold shared task file
 	:param pred_file: File with predictions
 	:param string_input: If True, files are replaced by strings with file contents (for import inside other scripts)
+	:param use_cache: If True, read the gold labels from a pre-parsed binary sidecar, building it if needed (see gold_cache.py)
 	:return: dictionary of scores for printing
+	:raises LabelCountMismatch: if gold and pred have different numbers of relation instances
 	"""
 
-	gold_labels = parse_data(gold_file, string_input)
-	pred_labels = parse_data(pred_file, string_input)
+	with stage("parse_gold"):
+		if use_cache and not string_input:
+			from gold_cache import load_cached
+			gold = load_cached(gold_file)
+			gold_labels = [gold["label_names"][code] for code in gold["labels"]]
+		else:
+			gold_labels = parse_data(gold_file, string_input)
+		count("labels", len(gold_labels))
+	with stage("parse_pred"):
+		pred_labels = parse_data(pred_file, string_input)
+		count("labels", len(pred_labels))
 
 	filename = gold_file.split(os.sep)[-1]
 
-	assert len(gold_labels) == len(pred_labels), "FATAL: different number of labels detected in gold and pred"
+	check_counts(gold_labels, pred_labels, filename, gold_file, string_input)
 
-	acc = accuracy_score(gold_labels, pred_labels)
+	with stage("score"):
+		acc, confusion, label_scores = score_labels(gold_labels, pred_labels)
 
 	score_dict = {"filename": filename,
 	              "acc_score": acc,
 	              "gold_rel_count": len(gold_labels),
-	              "pred_rel_count": len(pred_labels)}
+	              "pred_rel_count": len(pred_labels),
+	              "confusion": confusion,
+	              "label_scores": label_scores}
 
 	return score_dict
 
@@ -77,11 +165,24 @@ if __name__ == "__main__":
 	p.add_argument("goldfile", help="Shared task gold file in .rels format")
 	p.add_argument("predfile", help="Corresponding file with system predictions")
 	p.add_argument("-s", "--string_input", action="store_true", help="Whether inputs are filenames or strings")
+	p.add_argument("-c", "--cache", action="store_true", help="Use a pre-parsed binary sidecar of the gold file, building it if needed")
+	p.add_argument("-l", "--labels", action="store_true", help="Also print per-label precision, recall and f-score")
+	add_profile_args(p)
 
 	opts = p.parse_args()
-
-	report_dict = get_accuracy_score(opts.goldfile, opts.predfile, opts.string_input)
-	print(f"o File: {report_dict['filename']}")
-	print(f"o Number of Gold Relation Classification Instances: {report_dict['gold_rel_count']}")
-	print(f"o Number of Predicted Relation Classification Instances: {report_dict['pred_rel_count']}")
-	print(f"o Accuracy Score for Relation Classification: {report_dict['acc_score']}")
+	enable_profile("rel_eval", opts.profile, opts.profile_stage)
+
+	try:
+		report_dict = get_accuracy_score(opts.goldfile, opts.predfile, opts.string_input, opts.cache)
+	except EvaluationError as e:
+		sys.stderr.write(str(e))
+		sys.exit(1)
+	with stage("write"):
+		print(f"o File: {report_dict['filename']}")
+		print(f"o Number of Gold Relation Classification Instances: {report_dict['gold_rel_count']}")
+		print(f"o Number of Predicted Relation Classification Instances: {report_dict['pred_rel_count']}")
+		print(f"o Accuracy Score for Relation Classification: {report_dict['acc_score']}")
+		if opts.labels:
+			print("o Per-label scores (label, precision, recall, f-score, gold support):")
+			for label, scores in report_dict["label_scores"].items():
+				print(f"  {label}\t{scores['prec']:.4f}\t{scores['rec']:.4f}\t{scores['f_score']:.4f}\t{scores['support']}")
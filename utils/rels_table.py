@@ -0,0 +1,167 @@
+"""
+rels_table.py
+
+Memory-efficient readers for .rels files, shared by rel_eval.py and other scripts that analyze relation instances.
+
+Each .rels line has twelve tab-delimited columns, including four long text columns which are rarely needed for scoring
+or analysis. The readers in this module only split off the requested columns from either end of a line, so that e.g.
+reading labels costs one string per line instead of twelve:
+
+```
+labels = list(iter_column("../data/eng.rst.gum/eng.rst.gum_dev.rels", "label"))
+```
+
+RelsTable materializes a columnar table of all instances of a file, with categorical columns (doc, dir, orig_label and
+label) stored as integer codes and the unit token ranges as (first, last) token ID pairs.
+
+"""
+
+__license__ = "Apache 2.0"
+__version__ = "1.0.0"
+
+from array import array
+
+from conll_lines import read_lines
+
+REL_COLUMNS = ("doc", "unit1_toks", "unit2_toks", "unit1_txt", "unit2_txt", "s1_toks", "s2_toks",
+			   "unit1_sent", "unit2_sent", "dir", "orig_label", "label")
+REL_COLUMN_INDEX = {name: i for i, name in enumerate(REL_COLUMNS)}
+CATEGORICAL = ("doc", "dir", "orig_label", "label")
+SPANS = ("unit1_toks", "unit2_toks", "s1_toks", "s2_toks")
+
+
+def iter_lines(infile, string_input=False):
+	"""
+	Stream the lines of a .rels file which contain a tab, including the header row, as if the whole file had been
+	stripped of surrounding whitespace
+
+	:param infile: file name, or file contents if string_input is True
+	:param string_input: If True, infile is a string with file contents instead of a file name
+	:return: generator of lines
+	"""
+	lines = infile.strip().split("\n") if string_input else read_lines(infile)
+	for line in lines:
+		if "\t" in line:
+			yield line
+
+
+def field_getter(columns):
+	"""
+	Make a function extracting some columns from a .rels line. Columns in the first half of the line are split off
+	from the left and columns in the second half from the right, so the text columns in between are not split.
+
+	:param columns: sequence of column names, see REL_COLUMNS
+	:return: function taking a line and returning a tuple of the requested fields
+	"""
+	indices = [REL_COLUMN_INDEX[column] for column in columns]
+	half = len(REL_COLUMNS) // 2
+	n_front = max([i + 1 for i in indices if i < half] or [0])
+	n_back = max([len(REL_COLUMNS) - i for i in indices if i >= half] or [0])
+	positions = [(True, i) if i < half else (False, i - len(REL_COLUMNS)) for i in indices]
+
+	def get(line):
+		front = line.split("\t", n_front) if n_front > 0 else [line]
+		back = front[-1].rsplit("\t", n_back) if n_back > 0 else []
+		return tuple(front[i] if is_front else back[i] for is_front, i in positions)
+
+	return get
+
+
+def iter_column(infile, column="label", string_input=False):
+	"""
+	:param infile: .rels file name, or file contents if string_input is True
+	:param column: column name, see REL_COLUMNS
+	:param string_input: If True, infile is a string with file contents instead of a file name
+	:return: generator of the values of one column, including the header row; repeated values are shared strings
+	"""
+	get = field_getter([column])
+	interned = {}
+	for line in iter_lines(infile, string_input):
+		value = get(line)[0]
+		yield interned.setdefault(value, value)
+
+
+def span_bounds(range_string):
+	"""
+	:param range_string: token ID ranges of a unit, e.g. "2-6,10-17"
+	:return: tuple of the first and last token ID, e.g. (2, 17)
+	"""
+	first = range_string.split(",", 1)[0].split("-", 1)[0]
+	last = range_string.rsplit(",", 1)[-1].rsplit("-", 1)[-1]
+	return int(first), int(last)
+
+
+class Vocab(dict):
+	"""
+	Interned string table mapping strings to integer codes; unknown strings receive the next free code on lookup
+	"""
+
+	__slots__ = ("strings",)
+
+	def __init__(self):
+		super(Vocab, self).__init__()
+		self.strings = []
+
+	def __missing__(self, string):
+		code = len(self.strings)
+		self.strings.append(string)
+		self[string] = code
+		return code
+
+
+class RelsTable(object):
+	"""
+	Columnar table of the relation instances in a .rels file, without the header row and the text columns
+
+	:ivar vocabs: dictionary of categorical column name -> Vocab of its values
+	:ivar codes: dictionary of categorical column name -> array('I') of codes into its Vocab
+	:ivar spans: dictionary of token range column name -> array('I') of flattened (first, last) token ID pairs
+	"""
+
+	__slots__ = ("vocabs", "codes", "spans")
+
+	def __init__(self):
+		self.vocabs = {column: Vocab() for column in CATEGORICAL}
+		self.codes = {column: array("I") for column in CATEGORICAL}
+		self.spans = {column: array("I") for column in SPANS}
+
+	@classmethod
+	def load(cls, infile, string_input=False):
+		"""
+		:param infile: .rels file name, or file contents if string_input is True
+		:param string_input: If True, infile is a string with file contents instead of a file name
+		:return: RelsTable
+		"""
+		table = cls()
+		get = field_getter(CATEGORICAL + SPANS)
+		vocabs = [table.vocabs[column] for column in CATEGORICAL]
+		codes = [table.codes[column] for column in CATEGORICAL]
+		spans = [table.spans[column] for column in SPANS]
+		for l, line in enumerate(iter_lines(infile, string_input)):
+			if l == 0 and line.startswith("doc\t"):  # Header row
+				continue
+			fields = get(line)
+			for vocab, column, value in zip(vocabs, codes, fields):
+				column.append(vocab[value])
+			for column, value in zip(spans, fields[len(CATEGORICAL):]):
+				column.extend(span_bounds(value))
+		return table
+
+	def __len__(self):
+		return len(self.codes["label"])
+
+	def column(self, column):
+		"""
+		:param column: categorical column name, e.g. "label"
+		:return: list of the values of the column
+		"""
+		strings = self.vocabs[column].strings
+		return [strings[code] for code in self.codes[column]]
+
+	def unit_spans(self, column):
+		"""
+		:param column: token range column name, e.g. "unit1_toks"
+		:return: list of (first, last) token ID tuples
+		"""
+		flat = self.spans[column]
+		return list(zip(flat[0::2], flat[1::2]))
@@ -1,4 +1,11 @@
 import io, os, sys, argparse
+from array import array
+from bisect import bisect_right
+from itertools import zip_longest
+
+from conll_lines import normalize_label
+from eval_errors import EvaluationError, TokenCountMismatch
+from stage_profile import stage, collect, add_profile_args, enable_profile
 
 """
 Script to evaluate segmentation f-score and perfect discourse unit segmentation proportion from two files. Two input formats are permitted:
@@ -64,6 +71,10 @@ Arguments:
  * goldfile: shared task gold test data
  * predfile: same format, with predicted segments positions in column 10 - note **number of tokens must match**  
  * string_input: if specified, files are replaced by strings with file contents instead of file names
+ * -d/--docs: also print per-document scores, using the documents in goldfile (# newdoc id)
+ * -b/--bootstrap: number of document bootstrap resamples for 95% confidence intervals of precision, recall and f-score
+ * --compare: predictions of a second system, for a paired bootstrap significance test against predfile
+ * --profile: print stage timing and memory as JSON to stderr, or write it to a file given after the flag (see stage_profile.py)
 
 
 """
@@ -72,131 +83,202 @@ __author__ = "Amir Zeldes"
 __license__ = "Apache 2.0"
 __version__ = "1.0.1"
 
-def parse_data(infile, string_input=False):
+# Small integer codes for label arrays
+LABEL_CODES = {"_": 0, "BeginSeg=Yes": 1, "Seg=B-Conn": 2, "Seg=I-Conn": 3}
+CODE_LABELS = ("_", "BeginSeg=Yes", "Seg=B-Conn", "Seg=I-Conn")
+
+
+def iter_data(infile, string_input=False, docs=False):
+	"""
+	Stream (token, label) pairs from a .tok or .conllu file line by line, skipping multiword token lines
+
+	:param infile: file name, or file contents if string_input is True
+	:param string_input: If True, infile is a string with file contents instead of a file name
+	:param docs: If True, yield (document name, token, label) triples, using the last # newdoc id comment; comments
+	             without "=" (e.g. # newdoc id: d1) are ignored like other comments
+	:return: generator of (token string, normalized label) tuples
+	"""
 	if not string_input:
-		data = io.open(infile, encoding="utf8").read().strip().replace("\r", "")
+		handle = io.open(infile, encoding="utf8")
 	else:
-		data = infile.strip()
+		handle = io.StringIO(infile.strip().replace("\r", ""))
+
+	docname = ""
+	with handle:
+		for line in handle:
+			if "\t" in line:  # Token
+				fields = line.rstrip("\n").split("\t")
+				if "-" in fields[0]:
+					continue
+				if docs:
+					yield docname, fields[1], normalize_label(fields[-1])
+				else:
+					yield fields[1], normalize_label(fields[-1])
+			elif docs and line.startswith("# newdoc id") and "=" in line:
+				docname = line.split("=", 1)[1].strip()
+
+
+class SpanTracker(object):
+	"""
+	Incrementally collects connective spans from a stream of normalized labels.
+	Spans must begin with B-Conn; I-Conn labels outside of a span do not open one.
+	"""
+
+	__slots__ = ("start", "end", "counter")
+
+	def __init__(self):
+		self.start = -1
+		self.end = -1
+		self.counter = 0
+
+	def update(self, label):
+		"""
+		:param label: normalized label of the next token
+		:return: (start, end) tuple of a span closed by this token, or None
+		"""
+		span = None
+		if label == "Seg=B-Conn":
+			if self.start > -1:
+				span = (self.start, self.end if self.end > -1 else self.start)
+				self.end = -1
+			self.start = self.counter
+		elif label == "Seg=I-Conn":
+			self.end = self.counter
+		elif label == "_" and self.start > -1:
+			span = (self.start, self.end if self.end > -1 else self.start)
+			self.start = -1
+			self.end = -1
+		self.counter += 1
+		return span
+
+	def close(self):
+		"""
+		:return: the last span if one is still open at the end of the file, else None
+		"""
+		if self.start > -1 and self.end > -1:
+			return (self.start, self.end)
+		return None
 
+
+def parse_data(infile, string_input=False):
 	tokens = []
 	labels = []
 	spans = []
-	counter = 0
-	span_start = -1
-	span_end = -1
-	for line in data.split("\n"):
-		if "\t" in line:  # Token
-			fields = line.split("\t")
-			if "-" in fields[0]:
-				continue
-			label = fields[-1]
-			# Ensure correct labeling even if other pipe-delimited annotations found in column 10
-			if "BeginSeg=Yes" in label:
-				label = "BeginSeg=Yes"
-			elif "Seg=B-Conn" in label:
-				if span_start > -1:  # Add span
-					if span_end == -1:
-						span_end = span_start
-					spans.append((span_start,span_end))
-					span_end = -1
-				label ="Seg=B-Conn"
-				span_start = counter
-			elif "Seg=I-Conn" in label:
-				label = "Seg=I-Conn"
-				span_end = counter
-			else:
-				label = "_"
-				if span_start > -1:  # Add span
-					if span_end == -1:
-						span_end = span_start
-					spans.append((span_start,span_end))
-					span_start = -1
-					span_end = -1
-
-			tokens.append(fields[1])
-			labels.append(label)
-			counter +=1
-
-	if span_start > -1 and span_end > -1:  # Add last span
-		spans.append((span_start,span_end))
+	tracker = SpanTracker()
+	for token, label in iter_data(infile, string_input):
+		span = tracker.update(label)
+		if span is not None:
+			spans.append(span)
+		tokens.append(token)
+		labels.append(label)
+
+	span = tracker.close()
+	if span is not None:  # Add last span
+		spans.append(span)
 
 	return tokens, labels, spans
 
 
-def get_scores(gold_file, pred_file, string_input=False):
+def score_label_codes(gold_codes, pred_codes):
 	"""
+	Token-wise EDU scoring over label code arrays (see LABEL_CODES). Any differing non-empty prediction,
+	including an I-Conn/B-Conn mismatch, counts as a false positive. Uses NumPy if available.
 
-	:param gold_file: Gold shared task file
-	:param pred_file: File with predictions
-	:param string_input: If True, files are replaced by strings with file contents (for import inside other scripts)
-	:return: dictionary of scores for printing
+	:param gold_codes: array('b') of gold label codes
+	:param pred_codes: array('b') of predicted label codes, same length as gold_codes
+	:return: tuple of (true_positive, false_positive, false_negative) counts
 	"""
+	try:
+		import numpy as np
+	except ImportError:
+		np = None
+
+	if np is not None:
+		gold = np.frombuffer(gold_codes, dtype=np.int8)
+		pred = np.frombuffer(pred_codes, dtype=np.int8)
+		same = gold == pred
+		true_positive = int(np.count_nonzero(same & (gold != 0)))
+		false_negative = int(np.count_nonzero(~same & (pred == 0)))
+		false_positive = int(np.count_nonzero(~same & (pred != 0)))
+	else:
+		true_positive = false_positive = false_negative = 0
+		for gold_code, pred_code in zip(gold_codes, pred_codes):
+			if gold_code == pred_code:
+				if gold_code != 0:
+					true_positive += 1
+			elif pred_code == 0:
+				false_negative += 1
+			else:
+				false_positive += 1
 
+	return true_positive, false_positive, false_negative
 
-	report = ""
-	gold_tokens, gold_labels, gold_spans = parse_data(gold_file, string_input)
-	pred_tokens, pred_labels, pred_spans = parse_data(pred_file, string_input)
 
-	if os.path.isfile(gold_file):
-		doc_name = os.path.basename(gold_file)
-	else:
-		# Use first few tokens to identify file
-		doc_name = " ".join(gold_tokens[0:10]) + "..."
+def match_spans(gold_spans, pred_spans):
+	"""
+	Exact span matching in linear time using hashed lookups
 
-	# Check same number of tokens in both files
-	if len(gold_tokens) != len(pred_tokens):
-		report += "\nFATAL: different number of tokens detected in gold and pred:\n"
-		report += "  o In " + doc_name + ": " + str(len(gold_tokens)) + " gold tokens but " + str(len(pred_tokens)) + " predicted tokens\n\n"
-		sys.stderr.write(report)
-		sys.exit(0)
+	:param gold_spans: list of (start, end) gold connective spans
+	:param pred_spans: list of (start, end) predicted connective spans
+	:return: tuple of lists (matched, missed, spurious) - gold spans found in pred, gold spans not found in pred,
+	         and pred spans not found in gold, each in file order
+	"""
+	gold_set = set(gold_spans)
+	pred_set = set(pred_spans)
+	matched = [span for span in gold_spans if span in pred_set]
+	missed = [span for span in gold_spans if span not in pred_set]
+	spurious = [span for span in pred_spans if span not in gold_set]
+	return matched, missed, spurious
 
-	# Check tokens are identical
-	for i, tok in enumerate(gold_tokens):
-		if tok != pred_tokens[i]:
-			report += "\nWARN: token strings do not match in gold and pred:\n"
-			report += " o First instance in " + doc_name + " token " + str(i) + "\n"
-			report += "Gold: " + tok + " but Pred: " + pred_tokens[i] + "\n\n"
-			sys.stderr.write(report)
-			break
 
-	# Check if this is EDU or Conn-style data
-	if "BeginSeg=Yes" in gold_labels:
-		mode = "edu"
-		seg_type = "EDUs"
-	else:
-		mode = "conn"
-		seg_type = "conn spans"
+def doc_label_counts(gold_codes, pred_codes, doc_starts):
+	"""
+	Token-wise EDU scoring as in score_label_codes, broken down by document
 
-	true_positive = 0
-	false_positive = 0
-	false_negative = 0
+	:param gold_codes: array('b') of gold label codes
+	:param pred_codes: array('b') of predicted label codes, same length as gold_codes
+	:param doc_starts: increasing token indices at which each document starts, beginning with 0
+	:return: list of (true_positive, false_positive, false_negative) tuples, one per document
+	"""
+	try:
+		import numpy as np
+	except ImportError:
+		np = None
+
+	if len(doc_starts) == 0:
+		return []
+	if np is not None:
+		gold = np.frombuffer(gold_codes, dtype=np.int8)
+		pred = np.frombuffer(pred_codes, dtype=np.int8)
+		same = gold == pred
+		masks = np.stack([same & (gold != 0), ~same & (pred != 0), ~same & (pred == 0)]).astype(np.int64)
+		sums = np.add.reduceat(masks, np.asarray(doc_starts, dtype=np.int64), axis=1)
+		return [tuple(int(count) for count in doc) for doc in sums.T]
+
+	counts = []
+	bounds = list(doc_starts) + [len(gold_codes)]
+	for start, end in zip(bounds[:-1], bounds[1:]):
+		counts.append(score_label_codes(gold_codes[start:end], pred_codes[start:end]))
+	return counts
+
+
+def doc_span_counts(matched, missed, spurious, doc_starts):
+	"""
+	Assign span matching results to the documents in which the spans start
 
-	if mode == "edu":
-		for i, gold_label in enumerate(gold_labels):
-			pred_label = pred_labels[i]
-			if gold_label == pred_label:
-				if gold_label == "_":
-					continue
-				else:
-					true_positive += 1
-			else:
-				if pred_label == "_":
-					false_negative += 1
-				else:
-					if gold_label == "_":
-						false_positive += 1
-					else:  # I-Conn/B-Conn mismatch
-						false_positive +=1
-	else:
-		for span in gold_spans:
-			if span in pred_spans:
-				true_positive +=1
-			else:
-				false_negative +=1
-		for span in pred_spans:
-			if span not in gold_spans:
-				false_positive += 1
+	:return: list of (true_positive, false_positive, false_negative) tuples, one per document
+	"""
+	counts = [[0, 0, 0] for _ in doc_starts]
+	for spans, slot in [(matched, 0), (spurious, 1), (missed, 2)]:
+		for start, _ in spans:
+			counts[bisect_right(doc_starts, start) - 1][slot] += 1
+	return [tuple(doc) for doc in counts]
 
+
+def prf(true_positive, false_positive, false_negative):
+	"""
+	:return: tuple of precision, recall and f-score, each 0 if undefined
+	"""
 	try:
 		precision = true_positive / (float(true_positive) + false_positive)
 	except Exception as e:
@@ -212,15 +294,386 @@ def get_scores(gold_file, pred_file, string_input=False):
 	except:
 		f_score = 0
 
+	return precision, recall, f_score
+
+
+def percentile(sorted_values, q):
+	"""
+	Percentile with linear interpolation between closest ranks, as in numpy.percentile
+
+	:param sorted_values: sorted list of numbers
+	:param q: percentile between 0 and 100
+	"""
+	rank = (len(sorted_values) - 1) * q / 100.0
+	low = int(rank)
+	high = min(low + 1, len(sorted_values) - 1)
+	return sorted_values[low] + (sorted_values[high] - sorted_values[low]) * (rank - low)
+
+
+def bootstrap_scores(doc_counts, n_resamples=10000, seed=42, alpha=0.05, other_counts=None, block_size=1000):
+	"""
+	Document-level bootstrap over per-document count vectors. Each resample draws documents with replacement and
+	re-computes micro-averaged precision, recall and f-score from the summed counts. Resamples are computed as
+	matrix products of resampling weights with the count array, using NumPy if available.
+
+	If other_counts is given (per-document counts of a second system on the same gold data), a paired test is run on
+	the same resamples: p_value is the proportion of resamples in which the f-score difference (this system minus the
+	other) does not have the same sign as the observed difference.
+
+	:param doc_counts: list of (true_positive, false_positive, false_negative) tuples, one per document
+	:param n_resamples: number of bootstrap resamples
+	:param seed: random seed
+	:param alpha: significance level, e.g. 0.05 for 95% confidence intervals
+	:param other_counts: per-document counts of another system, in the same document order
+	:param block_size: number of resamples drawn at once, to bound memory use for large corpora
+	:return: dictionary with (low, high) intervals for "prec", "rec" and "f_score", and if other_counts is given,
+	         "f_delta" (observed f-score difference), "f_delta_ci" and "p_value"
+	"""
+	try:
+		import numpy as np
+	except ImportError:
+		np = None
+
+	n_docs = len(doc_counts)
+	systems = [doc_counts] if other_counts is None else [doc_counts, other_counts]
+	if other_counts is not None and len(other_counts) != n_docs:
+		raise ValueError("different number of documents for paired bootstrap")
+
+	samples = [[[], [], []] for _ in systems]  # Per system: lists of precision, recall and f-score samples
+	if np is not None:
+		rng = np.random.default_rng(seed)
+		count_arrays = [np.asarray(counts, dtype=np.float64).reshape(n_docs, 3) for counts in systems]
+		probs = np.full(n_docs, 1.0 / n_docs)
+		for block_start in range(0, n_resamples, block_size):
+			weights = rng.multinomial(n_docs, probs, size=min(block_size, n_resamples - block_start)).astype(np.float64)
+			for system, counts in enumerate(count_arrays):
+				tp, fp, fn = (weights @ counts).T
+				with np.errstate(divide="ignore", invalid="ignore"):
+					precision = np.where(tp + fp > 0, tp / (tp + fp), 0.0)
+					recall = np.where(tp + fn > 0, tp / (tp + fn), 0.0)
+					f_score = np.where(tp > 0, 2 * tp / (2 * tp + fp + fn), 0.0)
+				for values, new in zip(samples[system], [precision, recall, f_score]):
+					values.append(new)
+		samples = [[np.concatenate(values) for values in system] for system in samples]
+	else:
+		import random
+		rng = random.Random(seed)
+		for _ in range(n_resamples):
+			drawn = [rng.randrange(n_docs) for _ in range(n_docs)]
+			for system, counts in enumerate(systems):
+				tp = sum(counts[i][0] for i in drawn)
+				fp = sum(counts[i][1] for i in drawn)
+				fn = sum(counts[i][2] for i in drawn)
+				for values, new in zip(samples[system], prf(tp, fp, fn)):
+					values.append(new)
+
+	def interval(values):
+		values = sorted(values.tolist() if np is not None else values)
+		return percentile(values, 100 * alpha / 2), percentile(values, 100 * (1 - alpha / 2))
+
+	result = {"n_resamples": n_resamples, "alpha": alpha}
+	for name, values in zip(["prec", "rec", "f_score"], samples[0]):
+		result[name] = interval(values)
+
+	if other_counts is not None:
+		observed = prf(*[sum(doc[i] for doc in doc_counts) for i in range(3)])[2] - \
+				   prf(*[sum(doc[i] for doc in other_counts) for i in range(3)])[2]
+		if np is not None:
+			deltas = samples[0][2] - samples[1][2]
+			opposite = int(np.count_nonzero(deltas <= 0)) if observed >= 0 else int(np.count_nonzero(deltas >= 0))
+		else:
+			deltas = [a - b for a, b in zip(samples[0][2], samples[1][2])]
+			opposite = len([d for d in deltas if (d <= 0 if observed >= 0 else d >= 0)])
+		result["f_delta"] = observed
+		result["f_delta_ci"] = interval(deltas)
+		result["p_value"] = opposite / float(n_resamples)
+
+	return result
+
+
+def get_doc_scores(gold_file, pred_file, string_input=False, use_cache=False):
+	"""
+	Like get_scores, but also breaking down counts and scores by document (# newdoc id)
+
+	:return: dictionary of scores as returned by get_scores, with additional keys "doc_names", "doc_counts"
+	         (list of (true_positive, false_positive, false_negative) tuples) and "doc_scores" (list of
+	         (precision, recall, f-score) tuples), one entry per document
+	"""
+	return get_scores(gold_file, pred_file, string_input, use_cache, docs=True)
+
+
+def doc_records(doc_names, doc_starts, tokens, labels):
+	"""
+	Expand per-document token ranges into (document name, token, label) triples, as yielded by iter_data(docs=True)
+
+	:param doc_names: list of document names
+	:param doc_starts: index of the first token of each document
+	:param tokens: list of token strings
+	:param labels: iterable of normalized labels, one per token
+	:return: iterator of triples
+	"""
+	bounds = list(doc_starts) + [len(tokens)]
+	names = (name for i, name in enumerate(doc_names) for _ in range(bounds[i], bounds[i + 1]))
+	return zip(names, tokens, labels)
+
+
+def locate_token(index, doc_names, doc_starts):
+	"""
+	:return: tuple of the name of the document containing a token index, and the token's offset in that document
+	"""
+	doc = bisect_right(doc_starts, index) - 1
+	if doc < 0:
+		return None, index
+	return doc_names[doc], index - doc_starts[doc]
+
+
+def score_cached(gold, pred_records, doc_name, docs=False):
+	"""
+	Score predictions against pre-parsed gold data from a sidecar, using its label codes and connective spans directly.
+	Gold token strings are compared with the predicted tokens as one block of bytes, and only decoded to report a
+	mismatch.
+
+	:param gold: gold data as returned by gold_cache.load_cached
+	:param pred_records: iterable of predicted (token, normalized label) tuples
+	:param doc_name: name to identify the gold data in reports
+	:param docs: If True, add per-document counts
+	:return: dictionary of scores for printing (see score_records)
+	:raises TokenCountMismatch: if gold and pred have different numbers of tokens
+	"""
+	from gold_cache import decode_tokens
+
+	pred_tokens = []
+	pred_codes = array("b")
+	pred_spans = []
+	pred_tracker = SpanTracker()
+	for pred_tok, pred_label in pred_records:
+		pred_tokens.append(pred_tok)
+		pred_codes.append(LABEL_CODES[pred_label])
+		span = pred_tracker.update(pred_label)
+		if span is not None:
+			pred_spans.append(span)
+	span = pred_tracker.close()
+	if span is not None:
+		pred_spans.append(span)
+
+	gold_codes = gold["labels"]
+	doc_names = gold["doc_names"]
+	doc_starts = gold["doc_starts"]
+	gold_tok_count = len(gold_codes)
+	pred_tok_count = len(pred_tokens)
+	token_mismatch = None
+	count_mismatch = None
+	if gold_tok_count != pred_tok_count or gold["tokens"] != "\n".join(pred_tokens).encode("utf8"):
+		gold_tokens = decode_tokens(gold)
+		for index, (gold_tok, pred_tok) in enumerate(zip(gold_tokens, pred_tokens)):
+			if gold_tok != pred_tok:
+				doc, doc_offset = locate_token(index, doc_names, doc_starts)
+				token_mismatch = {"index": index, "doc": doc, "doc_offset": doc_offset, "gold": gold_tok, "pred": pred_tok}
+				break
+		if gold_tok_count != pred_tok_count:
+			index = min(gold_tok_count, pred_tok_count)
+			doc, doc_offset = locate_token(index, doc_names, doc_starts)
+			count_mismatch = {"index": index, "doc": doc, "doc_offset": doc_offset,
+							  "gold": gold_tokens[index] if index < gold_tok_count else None,
+							  "pred": pred_tokens[index] if index < pred_tok_count else None}
+
+	mode = "edu" if gold_codes.tobytes().find(bytes([LABEL_CODES["BeginSeg=Yes"]])) > -1 else "conn"
+	flat = gold["spans"]
+	gold_spans = list(zip(flat[0::2], flat[1::2]))
+	return score_codes(doc_name, mode, gold_codes, pred_codes, gold_spans, pred_spans, gold_tok_count, pred_tok_count,
+					   token_mismatch, count_mismatch, doc_names if docs else None, doc_starts)
+
+
+def get_scores(gold_file, pred_file, string_input=False, use_cache=False, docs=False):
+	"""
+
+	:param gold_file: Gold shared task file
+	:param pred_file: File with predictions
+	:param string_input: If True, files are replaced by strings with file contents (for import inside other scripts)
+	:param use_cache: If True, read the gold data from a pre-parsed binary sidecar, building it if needed (see gold_cache.py)
+	:param docs: If True, also compute per-document counts and scores (see get_doc_scores)
+	:return: dictionary of scores for printing
+	:raises TokenCountMismatch: if gold and pred have different numbers of tokens
+	"""
+
+	doc_name = os.path.basename(gold_file) if os.path.isfile(gold_file) else None
+	if use_cache and not string_input:
+		from gold_cache import load_cached
+		with stage("read_gold_cache"):
+			gold = load_cached(gold_file)
+		pred_records = collect("parse_pred", iter_data(pred_file, string_input), "tokens")
+		with stage("score"):
+			return score_cached(gold, pred_records, doc_name, docs=docs)
+
+	# Gold and pred are streamed into score_records, unless profiling separates parsing from scoring
+	gold_records = collect("parse_gold", iter_data(gold_file, string_input, docs=True), "tokens")
+	pred_records = collect("parse_pred", iter_data(pred_file, string_input), "tokens")
+	with stage("score"):
+		return score_records(gold_records, pred_records, doc_name, docs=docs)
+
+
+def score_records(gold_records, pred_records, doc_name=None, docs=False):
+	"""
+	Score two streams of (token, label) records, e.g. from iter_data or from a cached copy of a gold file
+
+	:param gold_records: iterable of gold (token, normalized label) tuples, or (document name, token, label) triples
+	                     to locate mismatches by document
+	:param pred_records: iterable of predicted (token, normalized label) tuples
+	:param doc_name: name to identify the gold data in reports; if None, the first gold tokens are used
+	:param docs: If True, add per-document counts; gold_records must be (document name, token, label) triples
+	:return: dictionary of scores for printing; "token_mismatch" describes the first differing token string, if any
+	         (see eval_errors.py)
+	:raises TokenCountMismatch: if gold and pred have different numbers of tokens
+	"""
+
+	gold_tok_count = 0
+	pred_tok_count = 0
+	first_tokens = []
+	token_mismatch = None
+	count_mismatch = None
+	gold_doc = None
+	doc_start = 0
+	mode = "conn"
+	gold_spans = []
+	pred_spans = []
+	gold_tracker = SpanTracker()
+	pred_tracker = SpanTracker()
+	gold_codes = array("b")
+	pred_codes = array("b")
+	doc_names = []
+	doc_starts = array("i")
+
+	# Consume gold and pred in lockstep, keeping only one byte per token and label
+	for gold, pred in zip_longest(gold_records, pred_records):
+		if gold is not None:
+			if len(gold) == 3:
+				doc, gold_tok, gold_label = gold
+				if doc != gold_doc or gold_tok_count == 0:
+					gold_doc = doc
+					doc_start = gold_tok_count
+					doc_names.append(doc)
+					doc_starts.append(gold_tok_count)
+			else:
+				gold_tok, gold_label = gold
+			gold_tok_count += 1
+		if pred is not None:
+			pred_tok_count += 1
+		if gold is None or pred is None:  # Token count mismatch - keep counting to report totals
+			if count_mismatch is None:
+				index = min(gold_tok_count, pred_tok_count)
+				count_mismatch = {"index": index, "doc": gold_doc, "doc_offset": index - doc_start,
+								  "gold": gold_tok if gold is not None else None, "pred": pred[0] if pred is not None else None}
+			continue
+		pred_tok, pred_label = pred
+		if len(first_tokens) < 10:
+			first_tokens.append(gold_tok)
+		if token_mismatch is None and gold_tok != pred_tok:
+			index = gold_tok_count - 1
+			token_mismatch = {"index": index, "doc": gold_doc, "doc_offset": index - doc_start, "gold": gold_tok, "pred": pred_tok}
+
+		if gold_label == "BeginSeg=Yes":
+			mode = "edu"
+
+		gold_codes.append(LABEL_CODES[gold_label])
+		pred_codes.append(LABEL_CODES[pred_label])
+
+		# Conn spans
+		span = gold_tracker.update(gold_label)
+		if span is not None:
+			gold_spans.append(span)
+		span = pred_tracker.update(pred_label)
+		if span is not None:
+			pred_spans.append(span)
+
+	if doc_name is None:
+		# Use first few tokens to identify file
+		doc_name = " ".join(first_tokens) + "..."
+
+	span = gold_tracker.close()
+	if span is not None:  # Add last span
+		gold_spans.append(span)
+	span = pred_tracker.close()
+	if span is not None:
+		pred_spans.append(span)
+
+	return score_codes(doc_name, mode, gold_codes, pred_codes, gold_spans, pred_spans, gold_tok_count, pred_tok_count,
+					   token_mismatch, count_mismatch, doc_names if docs else None, doc_starts)
+
+
+def score_codes(doc_name, mode, gold_codes, pred_codes, gold_spans, pred_spans, gold_tok_count, pred_tok_count,
+				token_mismatch=None, count_mismatch=None, doc_names=None, doc_starts=None):
+	"""
+	Check token counts and compute scores from label code arrays and connective spans, as collected by score_records
+	or read from a gold sidecar by score_cached
+
+	:param doc_name: name to identify the gold data in reports
+	:param mode: "edu" for EDU segmentation (token-wise scoring), "conn" for connective spans
+	:param gold_codes: array of gold label codes (see LABEL_CODES)
+	:param pred_codes: array of predicted label codes, same length as gold_codes if the token counts match
+	:param gold_spans: list of (start, end) gold connective spans
+	:param pred_spans: list of (start, end) predicted connective spans
+	:param gold_tok_count: number of gold tokens
+	:param pred_tok_count: number of predicted tokens
+	:param token_mismatch: description of the first differing token string, or None
+	:param count_mismatch: description of the position at which one file ended, or None
+	:param doc_names: list of gold document names to add per-document counts, or None
+	:param doc_starts: index of the first token of each document in doc_names
+	:return: dictionary of scores for printing (see score_records)
+	:raises TokenCountMismatch: if gold and pred have different numbers of tokens
+	"""
+
+	report = ""
+	matched, missed, spurious = [], [], []
+
+	# Check same number of tokens in both files
+	if gold_tok_count != pred_tok_count:
+		report += "\nFATAL: different number of tokens detected in gold and pred:\n"
+		report += "  o In " + doc_name + ": " + str(gold_tok_count) + " gold tokens but " + str(pred_tok_count) + " predicted tokens\n\n"
+		raise TokenCountMismatch(report, {"file": doc_name, "gold_count": gold_tok_count, "pred_count": pred_tok_count,
+										  "first_mismatch": token_mismatch if token_mismatch is not None else count_mismatch})
+
+	# Check tokens are identical
+	if token_mismatch is not None:
+		report += "\nWARN: token strings do not match in gold and pred:\n"
+		report += " o First instance in " + doc_name + " token " + str(token_mismatch["index"]) + "\n"
+		report += "Gold: " + token_mismatch["gold"] + " but Pred: " + token_mismatch["pred"] + "\n\n"
+		sys.stderr.write(report)
+
+	# Check if this is EDU or Conn-style data
+	if mode == "edu":
+		seg_type = "EDUs"
+		true_positive, false_positive, false_negative = score_label_codes(gold_codes, pred_codes)
+	else:
+		seg_type = "conn spans"
+		matched, missed, spurious = match_spans(gold_spans, pred_spans)
+		true_positive = len(matched)
+		false_negative = len(missed)
+		false_positive = len(spurious)
+
+	precision, recall, f_score = prf(true_positive, false_positive, false_negative)
+
 	score_dict = {}
 	score_dict["doc_name"] = doc_name
-	score_dict["tok_count"] = len(gold_tokens)
+	score_dict["tok_count"] = gold_tok_count
 	score_dict["seg_type"] = seg_type
 	score_dict["gold_seg_count"] = true_positive+false_negative
 	score_dict["pred_seg_count"] = true_positive+false_positive
 	score_dict["prec"] = precision
 	score_dict["rec"] = recall
 	score_dict["f_score"] = f_score
+	# Span lists for error analysis (empty for EDU-style data)
+	score_dict["matched_spans"] = matched
+	score_dict["missed_spans"] = missed
+	score_dict["spurious_spans"] = spurious
+	score_dict["token_mismatch"] = token_mismatch
+	if doc_names is not None:
+		if mode == "edu":
+			doc_counts = doc_label_counts(gold_codes, pred_codes, doc_starts)
+		else:
+			doc_counts = doc_span_counts(matched, missed, spurious, doc_starts)
+		score_dict["doc_names"] = doc_names
+		score_dict["doc_counts"] = doc_counts
+		score_dict["doc_scores"] = [prf(*counts) for counts in doc_counts]
 
 	return score_dict
 
@@ -231,15 +684,52 @@ if __name__ == "__main__":
 	p.add_argument("goldfile",help="Shared task gold file in .tok or .conll format")
 	p.add_argument("predfile",help="Corresponding file with system predictions")
 	p.add_argument("-s","--string_input",action="store_true",help="Whether inputs are file names or strings")
+	p.add_argument("-c","--cache",action="store_true",help="Use a pre-parsed binary sidecar of the gold file, building it if needed")
+	p.add_argument("-d","--docs",action="store_true",help="Also print per-document scores")
+	p.add_argument("-b","--bootstrap",type=int,default=0,help="Number of document bootstrap resamples for confidence intervals (e.g. 10000)")
+	p.add_argument("--compare",default=None,help="Predictions of a second system for a paired bootstrap significance test")
+	p.add_argument("--seed",type=int,default=42,help="Random seed for bootstrap resampling")
+	add_profile_args(p)
 
 	opts = p.parse_args()
+	enable_profile("seg_eval", opts.profile, opts.profile_stage)
 
-	score_dict = get_scores(opts.goldfile,opts.predfile,opts.string_input)
+	need_docs = opts.docs or opts.bootstrap > 0 or opts.compare is not None
+	try:
+		score_dict = get_scores(opts.goldfile,opts.predfile,opts.string_input,opts.cache,docs=need_docs)
+	except EvaluationError as e:
+		sys.stderr.write(str(e))
+		sys.exit(0)
 
-	print("File: " + score_dict["doc_name"])
-	print("o Total tokens: " + str(score_dict["tok_count"]))
-	print("o Gold " +score_dict["seg_type"]+": " + str(score_dict["gold_seg_count"]))
-	print("o Predicted "+score_dict["seg_type"]+": " + str(score_dict["pred_seg_count"]))
-	print("o Precision: " + str(score_dict["prec"]))
-	print("o Recall: " + str(score_dict["rec"]))
-	print("o F-Score: " + str(score_dict["f_score"]))
+	with stage("write"):
+		print("File: " + score_dict["doc_name"])
+		print("o Total tokens: " + str(score_dict["tok_count"]))
+		print("o Gold " +score_dict["seg_type"]+": " + str(score_dict["gold_seg_count"]))
+		print("o Predicted "+score_dict["seg_type"]+": " + str(score_dict["pred_seg_count"]))
+		print("o Precision: " + str(score_dict["prec"]))
+		print("o Recall: " + str(score_dict["rec"]))
+		print("o F-Score: " + str(score_dict["f_score"]))
+		if opts.docs:
+			print("o Per-document scores (document, true positives, false positives, false negatives, precision, recall, f-score):")
+			for name, counts, scores in zip(score_dict["doc_names"], score_dict["doc_counts"], score_dict["doc_scores"]):
+				print("  " + "\t".join([name] + [str(c) for c in counts] + ["%.4f" % score for score in scores]))
+	if opts.bootstrap > 0 or opts.compare is not None:
+		n_resamples = opts.bootstrap if opts.bootstrap > 0 else 10000
+		other_counts = None
+		if opts.compare is not None:
+			try:
+				other_counts = get_scores(opts.goldfile,opts.compare,opts.string_input,opts.cache,docs=True)["doc_counts"]
+			except EvaluationError as e:
+				sys.stderr.write(str(e))
+				sys.exit(0)
+		with stage("bootstrap"):
+			boot = bootstrap_scores(score_dict["doc_counts"], n_resamples, opts.seed, other_counts=other_counts)
+		with stage("write"):
+			level = str(int(round(100 * (1 - boot["alpha"])))) + "%"
+			print("o Bootstrap " + level + " confidence intervals (" + str(n_resamples) + " document resamples):")
+			for key, label in [("prec", "Precision"), ("rec", "Recall"), ("f_score", "F-Score")]:
+				print("  " + label + ": [" + "%.4f" % boot[key][0] + ", " + "%.4f" % boot[key][1] + "]")
+			if other_counts is not None:
+				print("o Paired bootstrap against " + os.path.basename(opts.compare) + ":")
+				print("  F-Score difference: " + "%.4f" % boot["f_delta"] + " [" + "%.4f" % boot["f_delta_ci"][0] + ", " + "%.4f" % boot["f_delta_ci"][1] + "]")
+				print("  p-value: " + str(boot["p_value"]))
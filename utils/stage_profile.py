@@ -0,0 +1,182 @@
+"""
+stage_profile.py
+
+Stage timing and memory instrumentation shared by seg_eval.py, rel_eval.py, process_files.py and
+process_underscores.py. Each script marks its stages (e.g. reading, parsing, scoring, restoring, writing) and counts
+lines or tokens; with profiling enabled, a JSON report with the wall time, counts and tracemalloc peak memory of each
+stage is written when the script exits:
+
+```
+python seg_eval.py gold.tok pred.tok --profile profile.json
+DISRPT_PROFILE=- python process_files.py "*.conllu"
+```
+
+Profiling is enabled with --profile (report printed to stderr, or written to a file name given after the flag), or
+by setting the environment variable DISRPT_PROFILE to "-" or a file name. The stage named by --profile_stage (or
+DISRPT_PROFILE_STAGE) is additionally run under cProfile, and its stats are dumped next to the report as
+<report>.<stage>.prof, or <script>.<stage>.prof if the report goes to stderr.
+
+When profiling is disabled, stage() returns a shared no-op context manager and count() and collect() return
+immediately, so that instrumented scripts run as before. Note that tracemalloc slows down allocation-heavy stages
+while profiling, and that stages run in worker processes (e.g. with -j) are not recorded.
+
+"""
+
+__license__ = "Apache 2.0"
+__version__ = "1.0.0"
+
+import io, os, sys, json, time, atexit, contextlib
+
+PROFILE_ENV = "DISRPT_PROFILE"
+PROFILE_STAGE_ENV = "DISRPT_PROFILE_STAGE"
+
+_NULL_STAGE = contextlib.nullcontext()
+_active = None  # StageProfiler of the running script, if profiling is enabled
+
+
+class StageProfiler(object):
+	"""
+	Accumulates wall time, peak traced memory and counts per stage name, in order of first use. Stages may be nested,
+	and repeated stages (e.g. one per input file) are added up. The peak of a stage is the highest traced memory while
+	it ran, including memory allocated before it started.
+	"""
+
+	def __init__(self, script, cprofile_stage=None):
+		import tracemalloc
+		self.script = script
+		self.cprofile_stage = cprofile_stage
+		self.cprofile = None
+		self.stages = {}
+		self.stack = []
+		self.counts = {}
+		self.tracemalloc = tracemalloc
+		self.start = time.perf_counter()
+		tracemalloc.start()
+
+	@contextlib.contextmanager
+	def stage(self, name):
+		stats = self.stages.setdefault(name, {"calls": 0, "wall_s": 0.0, "peak_bytes": 0, "counts": {}})
+		if len(self.stack) > 0:  # Keep the peak of the enclosing stage before resetting it
+			self.stack[-1][1] = max(self.stack[-1][1], self.tracemalloc.get_traced_memory()[1])
+		self.tracemalloc.reset_peak()
+		frame = [name, 0]
+		self.stack.append(frame)
+		profiling = name == self.cprofile_stage
+		if profiling:
+			if self.cprofile is None:
+				import cProfile
+				self.cprofile = cProfile.Profile()
+			self.cprofile.enable()
+		start = time.perf_counter()
+		try:
+			yield stats
+		finally:
+			stats["wall_s"] += time.perf_counter() - start
+			if profiling:
+				self.cprofile.disable()
+			self.stack.pop()
+			peak = max(frame[1], self.tracemalloc.get_traced_memory()[1])
+			stats["peak_bytes"] = max(stats["peak_bytes"], peak)
+			stats["calls"] += 1
+			if len(self.stack) > 0:
+				self.stack[-1][1] = max(self.stack[-1][1], peak)
+
+	def count(self, key, n=1):
+		counts = self.stages[self.stack[-1][0]]["counts"] if len(self.stack) > 0 else self.counts
+		counts[key] = counts.get(key, 0) + n
+
+	def report(self):
+		"""
+		:return: dictionary with the total wall time and peak traced memory, top level counts and a list of stages
+		"""
+		return {"script": self.script,
+				"argv": sys.argv[1:],
+				"wall_s": time.perf_counter() - self.start,
+				"peak_bytes": max([stats["peak_bytes"] for stats in self.stages.values()] + [self.tracemalloc.get_traced_memory()[1]]),
+				"counts": self.counts,
+				"stages": [dict(name=name, **stats) for name, stats in self.stages.items()]}
+
+	def write(self, outfile="-"):
+		"""
+		Write the JSON report, and the cProfile stats of the hot stage if it was run
+
+		:param outfile: output file name, or "-" for stderr
+		"""
+		if self.cprofile is not None:
+			prefix = self.script if outfile == "-" else outfile
+			self.cprofile.dump_stats(prefix + "." + self.cprofile_stage + ".prof")
+		output = json.dumps(self.report(), indent=2) + "\n"
+		if outfile == "-":
+			sys.stderr.write(output)
+		else:
+			with io.open(outfile, "w", encoding="utf8", newline="\n") as f:
+				f.write(output)
+
+
+def add_profile_args(parser):
+	"""
+	Add the --profile and --profile_stage options to a script's ArgumentParser
+	"""
+	parser.add_argument("--profile", nargs="?", const="-", default=None,
+						help="Write stage timing and memory as JSON to this file, or to stderr if no file is given")
+	parser.add_argument("--profile_stage", default=None, help="Also dump cProfile stats for this stage")
+
+
+def enable_profile(script, outfile=None, cprofile_stage=None):
+	"""
+	Enable profiling for the rest of the run if requested by options or environment variables, and write the report
+	when the interpreter exits
+
+	:param script: script name used in the report, e.g. "seg_eval"
+	:param outfile: output file name or "-" for stderr, e.g. from --profile; if None, DISRPT_PROFILE is used
+	:param cprofile_stage: stage to run under cProfile; if None, DISRPT_PROFILE_STAGE is used
+	:return: the StageProfiler, or None if profiling is disabled
+	"""
+	global _active
+	if outfile is None:
+		outfile = os.environ.get(PROFILE_ENV) or None
+		if outfile in ["1", "true"]:
+			outfile = "-"
+	if outfile is None:
+		return None
+	if cprofile_stage is None:
+		cprofile_stage = os.environ.get(PROFILE_STAGE_ENV) or None
+	_active = StageProfiler(script, cprofile_stage)
+	atexit.register(_active.write, outfile)
+	return _active
+
+
+def stage(name):
+	"""
+	:param name: stage name, e.g. "parse_gold"
+	:return: context manager timing the enclosed code as one run of the stage, or a no-op if profiling is disabled
+	"""
+	if _active is None:
+		return _NULL_STAGE
+	return _active.stage(name)
+
+
+def count(key, n=1):
+	"""
+	Add n to a counter (e.g. "lines" or "tokens") of the innermost running stage, if profiling is enabled
+	"""
+	if _active is not None:
+		_active.count(key, n)
+
+
+def collect(name, iterable, key="lines"):
+	"""
+	Consume a lazy stream as a separate stage when profiling, so that e.g. reading is timed apart from the processing
+	of its output
+
+	:param name: stage name
+	:param iterable: stream to consume
+	:param key: counter name for the number of items
+	:return: the stream itself if profiling is disabled, otherwise a list of its items
+	"""
+	if _active is None:
+		return iterable
+	with _active.stage(name):
+		items = list(iterable)
+		_active.count(key, len(items))
+	return items